@@ -1,9 +1,50 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session
+from flask import Flask, render_template, jsonify, request, redirect, url_for, session, Response, stream_with_context, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.wsgi import wrap_file
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from xml.sax.saxutils import escape
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import click
+import csv
+import functools
+import gzip
+import hashlib
+import io
+import json
+import math
+import mimetypes
+import operator
 import os
+import pickle
+import queue
+import random
+import re
+import socket
+import threading
+import time
+import unicodedata
+import uuid
+import zipfile
+
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se usa el módulo json estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se comprime con gzip
+    brotli = None
 
 app = Flask(__name__)
 
@@ -15,10 +56,21 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'mi_pequeño_universo_se
 CORS(app)
 db = SQLAlchemy(app)
 
+# 📊 INICIO DE MEDICIÓN (antes de la autenticación para medir también las redirecciones)
+@app.before_request
+def start_request_metrics():
+    g.metrics = {'started': time.perf_counter(), 'queries': 0, 'query_time': 0.0, 'lazy_loads': Counter()}
+
+# ⏰ BARRIDO DE CUOTAS VENCIDAS (se inicia con la primera petición de cada worker)
+@app.before_request
+def ensure_overdue_sweeper():
+    start_overdue_sweeper()
+
 # 🚨 MIDDLEWARE DE SEGURIDAD
 @app.before_request
 def check_auth():
-    if not request.endpoint or request.endpoint in ['login_page', 'login', 'static', 'logout']:
+    # /api/metrics valida su propio acceso (sesión de administrador o token del scraper)
+    if not request.endpoint or request.endpoint in ['login_page', 'login', 'static', 'logout', 'metrics']:
         return
     if not session.get('logged_in'):
         return redirect('/')
@@ -35,8 +87,8 @@ class User(db.Model):
 class SchoolYear(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     year = db.Column(db.String(20), nullable=False, unique=True)
-    start_date = db.Column(db.String(50), nullable=False)
-    end_date = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), default='active')
 
 class Classroom(db.Model):
@@ -61,74 +113,106 @@ class Student(db.Model):
     last_name = db.Column(db.String(100), nullable=False)
     first_name = db.Column(db.String(100), nullable=False)
     dni = db.Column(db.String(20), unique=True, nullable=False)
-    birth_date = db.Column(db.String(50), nullable=False)
+    birth_date = db.Column(db.Date, nullable=False)
     gender = db.Column(db.String(20), nullable=False)
     nationality = db.Column(db.String(50), default='Peruana')
     
+    # Los grupos siguientes se cargan solo al pedirlos (ver STUDENT_FIELD_GROUPS)
     # Información de Contacto
-    address = db.Column(db.Text, nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
-    email = db.Column(db.String(100))
-    photo = db.Column(db.String(200))
+    address = db.deferred(db.Column(db.Text, nullable=False), group='contact')
+    phone = db.deferred(db.Column(db.String(20), nullable=False), group='contact')
+    email = db.deferred(db.Column(db.String(100)), group='contact')
+    photo = db.deferred(db.Column(db.String(200)), group='contact')
     
     # Información del Padre
-    father_names = db.Column(db.String(100))
-    father_dni = db.Column(db.String(20))
-    father_birth_date = db.Column(db.String(50))
-    father_phone = db.Column(db.String(20))
-    father_email = db.Column(db.String(100))
-    father_occupation = db.Column(db.String(100))
+    father_names = db.deferred(db.Column(db.String(100)), group='parents')
+    father_dni = db.deferred(db.Column(db.String(20)), group='parents')
+    father_birth_date = db.deferred(db.Column(db.Date), group='parents')
+    father_phone = db.deferred(db.Column(db.String(20)), group='parents')
+    father_email = db.deferred(db.Column(db.String(100)), group='parents')
+    father_occupation = db.deferred(db.Column(db.String(100)), group='parents')
     
     # Información de la Madre
-    mother_names = db.Column(db.String(100))
-    mother_dni = db.Column(db.String(20))
-    mother_birth_date = db.Column(db.String(50))
-    mother_phone = db.Column(db.String(20))
-    mother_email = db.Column(db.String(100))
-    mother_occupation = db.Column(db.String(100))
+    mother_names = db.deferred(db.Column(db.String(100)), group='parents')
+    mother_dni = db.deferred(db.Column(db.String(20)), group='parents')
+    mother_birth_date = db.deferred(db.Column(db.Date), group='parents')
+    mother_phone = db.deferred(db.Column(db.String(20)), group='parents')
+    mother_email = db.deferred(db.Column(db.String(100)), group='parents')
+    mother_occupation = db.deferred(db.Column(db.String(100)), group='parents')
     
     # Contacto de Emergencia
-    emergency_contact = db.Column(db.String(100))
-    emergency_relationship = db.Column(db.String(50))
-    emergency_phone = db.Column(db.String(20))
-    emergency_address = db.Column(db.Text)
+    emergency_contact = db.deferred(db.Column(db.String(100)), group='emergency')
+    emergency_relationship = db.deferred(db.Column(db.String(50)), group='emergency')
+    emergency_phone = db.deferred(db.Column(db.String(20)), group='emergency')
+    emergency_address = db.deferred(db.Column(db.Text), group='emergency')
     
     # Datos Médicos
-    blood_type = db.Column(db.String(10))
-    height = db.Column(db.Float)
-    weight = db.Column(db.Float)
-    allergies = db.Column(db.Text)
-    medications = db.Column(db.Text)
-    medical_conditions = db.Column(db.Text)
-    activity_restrictions = db.Column(db.Text)
-    vaccines_up_to_date = db.Column(db.Boolean, default=True)
-    medical_observations = db.Column(db.Text)
+    blood_type = db.deferred(db.Column(db.String(10)), group='medical')
+    height = db.deferred(db.Column(db.Float), group='medical')
+    weight = db.deferred(db.Column(db.Float), group='medical')
+    allergies = db.deferred(db.Column(db.Text), group='medical')
+    medications = db.deferred(db.Column(db.Text), group='medical')
+    medical_conditions = db.deferred(db.Column(db.Text), group='medical')
+    activity_restrictions = db.deferred(db.Column(db.Text), group='medical')
+    vaccines_up_to_date = db.deferred(db.Column(db.Boolean, default=True), group='medical')
+    medical_observations = db.deferred(db.Column(db.Text), group='medical')
     
     status = db.Column(db.String(20), default='active')
-    enrollment_date = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    enrollment_date = db.Column(db.DateTime, default=datetime.now)
+    
+    # Nombres y DNI (del alumno y de los padres) normalizados para la búsqueda
+    search_text = db.deferred(db.Column(db.Text), group='search')
+    
+    __table_args__ = (
+        # Orden de la lista paginada y búsqueda por prefijo
+        db.Index('ix_student_last_name_id', 'last_name', 'id'),
+        db.Index('ix_student_first_name', 'first_name'),
+        db.Index('ix_student_status', 'status'),
+        db.Index('ix_student_birth_date', 'birth_date'),
+        # En Postgres LIKE 'x%' solo usa un btree con varchar_pattern_ops (salvo collation C);
+        # en SQLite bastan los índices anteriores, así que estos solo se crean en Postgres
+        db.Index('ix_student_last_name_pattern', 'last_name',
+                 postgresql_ops={'last_name': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_student_first_name_pattern', 'first_name',
+                 postgresql_ops={'first_name': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_student_dni_pattern', 'dni',
+                 postgresql_ops={'dni': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
 
 class Enrollment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), nullable=False)
-    enrollment_date = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    enrollment_date = db.Column(db.Date, default=date.today)
     status = db.Column(db.String(20), default='active')
    
     student = db.relationship('Student', backref=db.backref('enrollments', lazy=True))
     classroom = db.relationship('Classroom', backref=db.backref('enrollments', lazy=True))
+    
+    __table_args__ = (
+        # Matrícula activa de un alumno / alumnos activos de un aula
+        db.Index('ix_enrollment_student_status', 'student_id', 'status'),
+        db.Index('ix_enrollment_classroom_status', 'classroom_id', 'status'),
+        # Subconsulta NOT IN de alumnos no matriculados (índice cubriente)
+        db.Index('ix_enrollment_status_student', 'status', 'student_id'),
+    )
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     concept_id = db.Column(db.Integer, db.ForeignKey('payment_concept.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
-    payment_date = db.Column(db.String(50), nullable=False)
-    due_date = db.Column(db.String(50), nullable=False)
+    payment_date = db.Column(db.Date, nullable=False, index=True)
+    due_date = db.Column(db.Date, nullable=False, index=True)
     status = db.Column(db.String(20), default='pagado')
     receipt_number = db.Column(db.String(50), unique=True)
     
     student = db.relationship('Student', backref=db.backref('payments', lazy=True))
     concept = db.relationship('PaymentConcept', backref=db.backref('payments', lazy=True))
+    
+    __table_args__ = (
+        db.Index('ix_payment_student_id', 'student_id'),
+    )
 
 class PaymentPlan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -136,25 +220,74 @@ class PaymentPlan(db.Model):
     concept_id = db.Column(db.Integer, db.ForeignKey('payment_concept.id'), nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     installments = db.Column(db.Integer, nullable=False)
-    start_date = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), default='active')
-    created_date = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_date = db.Column(db.DateTime, default=datetime.now)
     
     student = db.relationship('Student')
     concept = db.relationship('PaymentConcept')
+    
+    __table_args__ = (
+        db.Index('ix_payment_plan_student_id', 'student_id'),
+    )
 
 class PaymentInstallment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     plan_id = db.Column(db.Integer, db.ForeignKey('payment_plan.id'), nullable=False)
     installment_number = db.Column(db.Integer, nullable=False)
-    due_date = db.Column(db.String(50), nullable=False)
+    due_date = db.Column(db.Date, nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')
-    payment_date = db.Column(db.String(50))
+    payment_date = db.Column(db.Date, index=True)
     payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'))
+    aging_bucket = db.Column(db.String(10))  # tramo de atraso de las cuotas 'overdue' (ver barrido)
+    late_fee_for_id = db.Column(db.Integer, db.ForeignKey('payment_installment.id'))  # cuota de mora de esa cuota
     
     plan = db.relationship('PaymentPlan')
     payment = db.relationship('Payment')
+    
+    __table_args__ = (
+        # Progreso por plan y cuotas vencidas
+        db.Index('ix_payment_installment_plan_status', 'plan_id', 'status'),
+        db.Index('ix_payment_installment_status_due_date', 'status', 'due_date'),
+        db.Index('ix_payment_installment_status_aging', 'status', 'aging_bucket'),
+        # Una sola cuota de mora por cuota vencida, aunque barran varios workers a la vez
+        db.Index('ix_payment_installment_late_fee_for_id', 'late_fee_for_id', unique=True),
+    )
+
+class AccountEntry(db.Model):
+    # Movimiento de la cuenta corriente del estudiante: 'cargo' (plan o pago suelto) o 'pago'
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    entry_date = db.Column(db.Date, nullable=False)
+    concept_id = db.Column(db.Integer, db.ForeignKey('payment_concept.id'))
+    plan_id = db.Column(db.Integer, db.ForeignKey('payment_plan.id'))
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    concept = db.relationship('PaymentConcept')
+    
+    __table_args__ = (
+        db.Index('ix_account_entry_student_id', 'student_id', 'id'),
+    )
+
+class StudentAccount(db.Model):
+    # Saldo de cada estudiante, actualizado en la misma transacción que sus movimientos
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    charged = db.Column(db.Float, nullable=False, default=0)
+    paid = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    last_payment_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+    
+    student = db.relationship('Student')
+    
+    __table_args__ = (
+        # Lista de morosos ordenada por saldo sin recorrer la tabla
+        db.Index('ix_student_account_balance', 'balance', 'student_id'),
+    )
 
 class AlmacenUtil(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -162,21 +295,30 @@ class AlmacenUtil(db.Model):
     material = db.Column(db.String(200), nullable=False)
     cantidad_requerida = db.Column(db.Integer, nullable=False)
     especificaciones = db.Column(db.Text)
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     
     aula = db.relationship('Classroom', backref=db.backref('utiles', lazy=True))
+    
+    __table_args__ = (
+        db.Index('ix_almacen_util_aula_id', 'aula_id'),
+    )
 
 class AlmacenEntrega(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     estudiante_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     util_id = db.Column(db.Integer, db.ForeignKey('almacen_util.id'), nullable=False)
     cantidad_entregada = db.Column(db.Integer, nullable=False)
-    fecha_entrega = db.Column(db.String(50))
+    fecha_entrega = db.Column(db.Date)
     observaciones = db.Column(db.Text)
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     
     estudiante = db.relationship('Student', backref=db.backref('entregas_utiles', lazy=True))
     util = db.relationship('AlmacenUtil', backref=db.backref('entregas', lazy=True))
+    
+    __table_args__ = (
+        db.Index('ix_almacen_entrega_estudiante_util', 'estudiante_id', 'util_id'),
+        db.Index('ix_almacen_entrega_util_id', 'util_id'),
+    )
 
 class MaterialAula(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -188,7 +330,7 @@ class MaterialAula(db.Model):
     unidad_medida = db.Column(db.String(50), default='unidades')
     ubicacion = db.Column(db.String(100))
     proveedor = db.Column(db.String(100))
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
 
 class MovimientoMaterial(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -197,9 +339,9 @@ class MovimientoMaterial(db.Model):
     cantidad = db.Column(db.Integer, nullable=False)
     motivo = db.Column(db.String(200), nullable=False)
     observaciones = db.Column(db.Text)
-    fecha_movimiento = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    fecha_movimiento = db.Column(db.DateTime, default=datetime.now)
     responsable = db.Column(db.String(100))
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     
     material = db.relationship('MaterialAula', backref=db.backref('movimientos', lazy=True))
 
@@ -215,11 +357,11 @@ class BienAula(db.Model):
     estado = db.Column(db.String(50), default='bueno')
     ubicacion = db.Column(db.String(100))
     aula_id = db.Column(db.Integer, db.ForeignKey('classroom.id'))
-    fecha_adquisicion = db.Column(db.String(50))
+    fecha_adquisicion = db.Column(db.Date)
     valor_adquisicion = db.Column(db.Float)
     proveedor = db.Column(db.String(100))
     observaciones = db.Column(db.Text)
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     
     aula = db.relationship('Classroom', backref=db.backref('bienes', lazy=True))
 
@@ -227,15 +369,976 @@ class MantenimientoBien(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bien_id = db.Column(db.Integer, db.ForeignKey('bien_aula.id'), nullable=False)
     tipo_mantenimiento = db.Column(db.String(50), nullable=False)
-    fecha_mantenimiento = db.Column(db.String(50), nullable=False)
+    fecha_mantenimiento = db.Column(db.Date, nullable=False)
     descripcion = db.Column(db.Text, nullable=False)
     costo = db.Column(db.Float, default=0)
     proveedor_mantenimiento = db.Column(db.String(100))
     observaciones = db.Column(db.Text)
-    created_at = db.Column(db.String(50), default=lambda: datetime.now().isoformat())
+    created_at = db.Column(db.DateTime, default=datetime.now)
     
     bien = db.relationship('BienAula', backref=db.backref('mantenimientos', lazy=True))
 
+class ReceiptCounter(db.Model):
+    # Último correlativo de recibo emitido por día (R-YYYYMMDD-NNNN)
+    day = db.Column(db.Date, primary_key=True)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+class TableVersion(db.Model):
+    # Se incrementa en la misma transacción que modifica la tabla (ver ETags)
+    table_name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    # Trabajo en segundo plano: la ruta `endpoint` ejecutada fuera de la petición
+    id = db.Column(db.String(32), primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    path = db.Column(db.String(200), nullable=False)
+    params = db.Column(db.Text, nullable=False)  # JSON: method, view_args, args, body
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    user_id = db.Column(db.Integer)
+    worker = db.Column(db.String(100))  # host:pid del proceso que lo ejecuta
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    result_status = db.Column(db.Integer)
+    result_mimetype = db.Column(db.String(100))
+    result_filename = db.Column(db.String(200))
+    # El cuerpo del resultado va en un archivo de JOB_RESULTS_DIR (ver job_result_path)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
+# === CACHÉ DE RESPUESTAS ===
+# Las respuestas cacheadas guardan la versión de cada tabla de la que dependen,
+# tomada de TableVersion (la misma que usan los ETags). Al confirmar una transacción
+# que modificó una tabla se incrementa su versión en la base, así una escritura en
+# cualquier worker invalida las entradas de todos. Con CACHE_REDIS_URL las entradas
+# además se comparten entre los workers de gunicorn.
+app.config.setdefault('RESPONSE_CACHE_TTL', int(os.environ.get('RESPONSE_CACHE_TTL', 300)))
+app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256)))
+
+class MemoryCacheBackend:
+    """Caché local del proceso con expiración (TTL) y descarte LRU"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedisCacheBackend:
+    """Caché compartida entre workers (requiere el paquete redis)"""
+    def __init__(self, url, prefix='mpu:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+    
+    def get(self, key):
+        value = self.client.get(self.prefix + 'cache:' + key)
+        return pickle.loads(value) if value is not None else None
+    
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + 'cache:' + key, pickle.dumps(value), ex=ttl)
+    
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + 'cache:*'):
+            self.client.delete(key)
+
+def create_cache_backend():
+    redis_url = os.environ.get('CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            return RedisCacheBackend(redis_url)
+        except ImportError:
+            print("⚠️ CACHE_REDIS_URL definido pero falta el paquete redis; se usa la caché local")
+    return MemoryCacheBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+
+response_cache = create_cache_backend()
+
+def cached_response(*tables, ttl=None):
+    """Cachea la respuesta JSON del endpoint hasta que cambie alguna de `tables`"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Las exportaciones en streaming no se cachean
+            if request.args.get('format'):
+                return view(*args, **kwargs)
+            
+            versions = get_table_versions(tables)
+            if None in versions:
+                # Sin fila de versión no se puede invalidar: no se cachea
+                return view(*args, **kwargs)
+            query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+            # La fecha entra en la clave porque edades y días de mora cambian cada día
+            key = f"{request.endpoint}:{kwargs}:{query}:{date.today().isoformat()}"
+            
+            cached = response_cache.get(key)
+            if cached is not None and cached[0] == versions:
+                _, body, status, mimetype = cached
+                return Response(body, status=status, mimetype=mimetype)
+            
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(
+                    key,
+                    (versions, response.get_data(), response.status_code, response.mimetype),
+                    ttl or app.config['RESPONSE_CACHE_TTL']
+                )
+            return response
+        return wrapper
+    return decorator
+
+def track_changed_tables(session, tables):
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+@event.listens_for(db.session, 'after_flush')
+def collect_flushed_tables(session, flush_context):
+    tables = {
+        obj.__table__.name
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if hasattr(obj, '__table__')
+    }
+    if tables:
+        track_changed_tables(session, tables)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def collect_bulk_statement_tables(orm_execute_state):
+    # UPDATE/DELETE/INSERT masivos (por ejemplo los cupos de aula) no pasan por el flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        track_changed_tables(orm_execute_state.session, {orm_execute_state.statement.table.name})
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_changed_tables(session):
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        bump_table_versions(changed)
+        live_events.notify(changed)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_changed_tables(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('changed_tables', None)
+
+# === ETAGS PARA DATOS DE REFERENCIA ===
+# Las versiones viven en la tabla TableVersion, así todos los workers calculan el
+# mismo ETag. Se incrementan una vez por transacción, después del commit y en una
+# transacción propia y corta: si el UPDATE fuera dentro de la transacción que
+# escribe, la fila de la tabla quedaría bloqueada y en Postgres todos los que
+# escriben en ella esperarían al commit del anterior.
+def bump_table_versions(tables):
+    versions = TableVersion.__table__
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(versions).where(
+                    versions.c.table_name.in_(sorted(tables))
+                ).values(version=versions.c.version + 1)
+            )
+    except Exception as e:
+        # Los datos ya se confirmaron; el ETag se corrige con la próxima escritura
+        print("⚠️ No se pudieron incrementar las versiones de", sorted(tables), str(e))
+
+def get_table_versions(tables):
+    versions = TableVersion.__table__
+    rows = db.session.execute(
+        db.select(versions.c.table_name, versions.c.version).where(versions.c.table_name.in_(tables))
+    ).all()
+    found = dict(rows)
+    # None: la tabla no tiene fila de versión (seed_table_versions aún no corrió)
+    return [found.get(table) for table in tables]
+
+def seed_table_versions():
+    """Crea la fila de versión de cada tabla que aún no la tenga"""
+    versions = TableVersion.__table__
+    existing = {row[0] for row in db.session.execute(db.select(versions.c.table_name))}
+    missing = [t.name for t in db.metadata.sorted_tables if t.name not in existing]
+    if missing:
+        db.session.execute(db.insert(versions), [{'table_name': name, 'version': 0} for name in missing])
+        db.session.commit()
+
+def etag_response(*tables):
+    """Responde 304 Not Modified si el cliente ya tiene la versión actual de `tables`"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            
+            versions = get_table_versions(tables)
+            if None in versions:
+                # Sin versión no hay forma de saber si cambió: respuesta completa y sin ETag
+                return view(*args, **kwargs)
+            args_key = sorted(request.args.items(multi=True))
+            etag = hashlib.sha1(repr((request.endpoint, kwargs, args_key, versions)).encode()).hexdigest()
+            
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            # no-cache: el navegador guarda la respuesta pero siempre revalida con If-None-Match.
+            # ETag débil porque el cuerpo puede ir comprimido o no según Accept-Encoding
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# === EVENTOS EN VIVO (SERVER-SENT EVENTS) ===
+# Un solo hilo publicador por worker recalcula la ocupación de las aulas y los
+# contadores del dashboard cuando se confirma una transacción que toca esas tablas,
+# y reparte solo lo que cambió a la cola de cada pestaña conectada: N pestañas
+# abiertas cuestan un cálculo, no N consultas. Los cambios hechos en otros workers
+# se detectan comparando las versiones de TableVersion cada LIVE_EVENTS_POLL_SECONDS.
+app.config.setdefault('LIVE_EVENTS_MAX_SUBSCRIBERS', int(os.environ.get('LIVE_EVENTS_MAX_SUBSCRIBERS', 8)))
+app.config.setdefault('LIVE_EVENTS_POLL_SECONDS', float(os.environ.get('LIVE_EVENTS_POLL_SECONDS', 5)))
+app.config.setdefault('LIVE_EVENTS_KEEPALIVE', int(os.environ.get('LIVE_EVENTS_KEEPALIVE', 15)))
+app.config.setdefault('LIVE_EVENTS_MAX_AGE', int(os.environ.get('LIVE_EVENTS_MAX_AGE', 600)))
+LIVE_EVENT_TABLES = ('classroom', 'enrollment', 'payment_concept', 'school_year', 'student')
+LIVE_EVENTS_QUEUE_SIZE = 32
+LIVE_EVENTS_DEBOUNCE = 0.2  # agrupa las ráfagas de commits en un solo cálculo
+LIVE_EVENTS_RETRY_MS = 3000  # espera del navegador antes de reconectar
+
+def format_live_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+class LiveEventPublisher:
+    """Estado compartido del flujo en vivo y colas de las pestañas suscritas"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.subscribers = set()
+        self.thread = None
+        self.classrooms = None
+        self.counters = None
+        self.versions = None
+        self.sequence = 0
+    
+    def notify(self, tables):
+        if self.subscribers and not set(LIVE_EVENT_TABLES).isdisjoint(tables):
+            self.changed.set()
+    
+    def subscribe(self):
+        """Cola con el estado actual como primer evento (None si no hay lugar)"""
+        with self.lock:
+            if len(self.subscribers) >= app.config['LIVE_EVENTS_MAX_SUBSCRIBERS']:
+                return None
+            # Sin suscriptores nadie mantuvo el estado al día: se compara con la base
+            versions = get_table_versions(LIVE_EVENT_TABLES)
+            if self.classrooms is None or versions != self.versions or not self.subscribers:
+                self.refresh(versions)
+            
+            events = queue.Queue(maxsize=LIVE_EVENTS_QUEUE_SIZE)
+            events.put(self.snapshot_event())
+            self.subscribers.add(events)
+            
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='live-events', daemon=True)
+                self.thread.start()
+            return events
+    
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers.discard(events)
+    
+    def snapshot_event(self):
+        return format_live_event('snapshot', {
+            'classrooms': list(self.classrooms.values()),
+            'counters': self.counters
+        }, self.sequence)
+    
+    def refresh(self, versions):
+        """Recalcula el estado y envía a los suscriptores solo lo que cambió"""
+        classrooms = {
+            classroom['id']: classroom
+            for classroom in AVAILABLE_CLASSROOM_SERIALIZER.many(Classroom.query.filter_by(status='active').all())
+        }
+        counters = dashboard_counters()
+        previous_classrooms, previous_counters = self.classrooms, self.counters
+        self.classrooms, self.counters, self.versions = classrooms, counters, versions
+        if previous_classrooms is None:
+            return
+        
+        delta = {}
+        changed = [c for classroom_id, c in classrooms.items() if previous_classrooms.get(classroom_id) != c]
+        removed = [classroom_id for classroom_id in previous_classrooms if classroom_id not in classrooms]
+        changed_counters = {k: v for k, v in counters.items() if previous_counters.get(k) != v}
+        if changed:
+            delta['classrooms'] = changed
+        if removed:
+            delta['removed_classrooms'] = removed
+        if changed_counters:
+            delta['counters'] = changed_counters
+        if delta:
+            self.sequence += 1
+            self.broadcast(format_live_event('delta', delta, self.sequence))
+    
+    def broadcast(self, message):
+        # El mensaje se serializa una vez y se comparte entre todas las pestañas
+        for events in list(self.subscribers):
+            try:
+                events.put_nowait(message)
+            except queue.Full:
+                # Pestaña que no lee: se descarta lo pendiente y se le reenvía el estado completo
+                while not events.empty():
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        break
+                events.put_nowait(self.snapshot_event())
+    
+    def run(self):
+        while True:
+            notified = self.changed.wait(app.config['LIVE_EVENTS_POLL_SECONDS'])
+            if notified:
+                time.sleep(LIVE_EVENTS_DEBOUNCE)
+                self.changed.clear()
+            if not self.subscribers:
+                continue
+            try:
+                with app.app_context():
+                    with self.lock:
+                        versions = get_table_versions(LIVE_EVENT_TABLES)
+                        if notified or versions != self.versions:
+                            self.refresh(versions)
+            except Exception as e:
+                print("❌ Error en el publicador de eventos en vivo:", str(e))
+
+live_events = LiveEventPublisher()
+
+# === MÉTRICAS (FORMATO PROMETHEUS) ===
+# Cada worker de gunicorn lleva sus propios contadores; Prometheus los suma por instancia.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+ADMIN_ROLES = ('admin', 'superadmin')
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+class MetricsRegistry:
+    """Contadores e histogramas por endpoint, en memoria del proceso"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.latency = {}
+            self.queries = {}
+            self.query_time = {}
+            self.response_bytes = {}
+            self.responses = {}
+    
+    def observe_request(self, endpoint, method, status, duration, queries, query_time, size):
+        key = (endpoint, method)
+        with self.lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(queries)
+            self.query_time[key] = self.query_time.get(key, 0.0) + query_time
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + (size or 0)
+            status_key = (endpoint, method, str(status))
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+    
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)"""
+        lines = []
+        
+        def labels(**values):
+            return ','.join(f'{name}="{prometheus_escape(value)}"' for name, value in values.items())
+        
+        def histogram(name, help_text, data):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (endpoint, method), hist in sorted(data.items()):
+                base = labels(endpoint=endpoint, method=method)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{base},le="+Inf"}} {hist.total}')
+                lines.append(f'{name}_sum{{{base}}} {hist.sum}')
+                lines.append(f'{name}_count{{{base}}} {hist.total}')
+        
+        def counter(name, help_text, data, label_names=('endpoint', 'method')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in sorted(data.items()):
+                lines.append(f'{name}{{{labels(**dict(zip(label_names, key)))}}} {value}')
+        
+        with self.lock:
+            counter('http_requests_total', 'Respuestas por endpoint y código de estado',
+                    self.responses, ('endpoint', 'method', 'status'))
+            histogram('http_request_duration_seconds', 'Latencia de las peticiones', self.latency)
+            histogram('http_request_sql_queries', 'Consultas SQL ejecutadas por petición', self.queries)
+            counter('http_request_sql_seconds_total', 'Tiempo acumulado en consultas SQL', self.query_time)
+            counter('http_response_size_bytes_total', 'Bytes enviados (sin respuestas en streaming)',
+                    self.response_bytes)
+        
+        lines.append('# HELP process_start_time_seconds Inicio del proceso (epoch)')
+        lines.append('# TYPE process_start_time_seconds gauge')
+        lines.append(f'process_start_time_seconds {self.started}')
+        return '\n'.join(lines) + '\n'
+
+metrics_registry = MetricsRegistry()
+
+def prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def is_admin_session():
+    return bool(session.get('logged_in')) and session.get('role') in ADMIN_ROLES
+
+# === REGISTRO DE CONSULTAS LENTAS ===
+# Umbral en milisegundos; SLOW_QUERY_EXPLAIN=0 desactiva la captura del plan.
+app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200)))
+app.config.setdefault('SLOW_QUERY_EXPLAIN', os.environ.get('SLOW_QUERY_EXPLAIN', '1') != '0')
+app.config.setdefault('SLOW_QUERY_LOG_SIZE', int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100)))
+
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+class SlowQueryLog:
+    """Últimas consultas lentas (buffer circular) con el plan de su primera aparición"""
+    
+    def __init__(self, size, max_plans=500):
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=size)
+        self.plans = OrderedDict()
+        self.max_plans = max_plans
+    
+    def record(self, engine, statement, parameters, executemany, duration):
+        plan = None
+        with self.lock:
+            first_time = statement not in self.plans
+            if first_time:
+                self.plans[statement] = None
+                if len(self.plans) > self.max_plans:
+                    self.plans.popitem(last=False)
+        
+        if first_time and app.config['SLOW_QUERY_EXPLAIN'] and not executemany:
+            plan = self.explain(engine, statement, parameters)
+            with self.lock:
+                self.plans[statement] = plan
+        
+        entry = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'method': request.method if has_request_context() else None,
+            'duration_ms': round(duration * 1000, 2),
+            'statement': statement,
+            'parameters': repr(parameters)[:500],
+            'first_occurrence': first_time,
+            'plan': plan
+        }
+        with self.lock:
+            self.entries.append(entry)
+        print(f"🐢 Consulta lenta ({entry['duration_ms']} ms) en {entry['endpoint']}: {' '.join(statement.split())[:120]}")
+    
+    def explain(self, engine, statement, parameters):
+        if not statement.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+            return None
+        # Conexión aparte: un EXPLAIN fallido no debe abortar la transacción de la petición
+        try:
+            with engine.connect() as connection:
+                return explain_statement(connection, statement, parameters)
+        except Exception as e:
+            return [f'No se pudo obtener el plan: {e}']
+    
+    def snapshot(self):
+        with self.lock:
+            return list(reversed(self.entries))
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.plans.clear()
+
+slow_query_log = SlowQueryLog(app.config['SLOW_QUERY_LOG_SIZE'])
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is None or statement.startswith('EXPLAIN'):
+        return
+    
+    elapsed = time.perf_counter() - started
+    # count_query=False: consultas de preparación del proceso, ajenas a la petición
+    if has_request_context() and 'metrics' in g and conn.get_execution_options().get('count_query', True):
+        g.metrics['queries'] += 1
+        g.metrics['query_time'] += elapsed
+    if elapsed * 1000 >= app.config['SLOW_QUERY_THRESHOLD_MS']:
+        slow_query_log.record(conn.engine, statement, parameters, executemany, elapsed)
+
+@app.after_request
+def record_request_metrics(response):
+    current = g.get('metrics')
+    if current is None:
+        return response
+    
+    labels = (request.endpoint or 'not_found', request.method, response.status_code)
+    size = None if response.is_streamed else response.calculate_content_length()
+    
+    # Se registra al cerrar la respuesta para incluir las exportaciones en streaming completas
+    def observe():
+        metrics_registry.observe_request(
+            *labels,
+            time.perf_counter() - current['started'],
+            current['queries'],
+            current['query_time'],
+            size
+        )
+    response.call_on_close(observe)
+    return response
+
+@app.route('/api/metrics')
+def metrics():
+    """Métricas para Prometheus: solo administradores o el token METRICS_TOKEN"""
+    token = os.environ.get('METRICS_TOKEN')
+    authorized = is_admin_session()
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        authorized = True
+    if not authorized:
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/slow-queries', methods=['GET', 'DELETE'])
+def slow_queries():
+    """Consultas lentas recientes con su plan de ejecución (solo administradores)"""
+    if not is_admin_session():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    
+    if request.method == 'DELETE':
+        slow_query_log.clear()
+        return jsonify({'success': True})
+    
+    return jsonify({
+        'success': True,
+        'threshold_ms': app.config['SLOW_QUERY_THRESHOLD_MS'],
+        'data': slow_query_log.snapshot()
+    })
+
+# === PRESUPUESTO DE CONSULTAS (DETECCIÓN DE N+1) ===
+# Cada ruta declara cuántas consultas puede ejecutar. Con app.testing o
+# QUERY_BUDGET_ENFORCE=1 exceder el presupuesto lanza QueryBudgetExceeded;
+# en producción solo se avisa por consola.
+app.config.setdefault('QUERY_BUDGET_ENFORCE', os.environ.get('QUERY_BUDGET_ENFORCE') == '1')
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+@event.listens_for(db.session, 'do_orm_execute')
+def detect_lazy_load(orm_execute_state):
+    # Carga perezosa de una relación: se cuenta por relación para detectar bucles
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    if not has_request_context() or 'metrics' not in g:
+        return
+    relationship = orm_execute_state.loader_strategy_path.path[-1]
+    g.metrics['lazy_loads'][f'{relationship.parent.class_.__name__}.{relationship.key}'] += 1
+
+def repeated_lazy_loads():
+    """Relaciones cargadas perezosamente más de una vez en la petición (N+1)"""
+    current = g.get('metrics')
+    if current is None:
+        return {}
+    return {name: count for name, count in current['lazy_loads'].items() if count > 1}
+
+def query_budget(budget):
+    """Máximo de consultas SQL de un GET a la ruta (sin contar respuestas en streaming)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            current = g.get('metrics')
+            if request.method != 'GET' or current is None or current['queries'] <= budget:
+                return response
+            
+            message = f"{request.endpoint}: {current['queries']} consultas (presupuesto {budget})"
+            lazy = repeated_lazy_loads()
+            if lazy:
+                message += '; cargas perezosas repetidas: ' + ', '.join(f'{k} ×{v}' for k, v in sorted(lazy.items()))
+            if app.testing or app.config['QUERY_BUDGET_ENFORCE']:
+                raise QueryBudgetExceeded(message)
+            print(f"⚠️ Presupuesto de consultas excedido en {message}")
+            return response
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
+
+# === TRABAJOS EN SEGUNDO PLANO ===
+# Con ?async=1 las rutas marcadas con @background_job responden 202 con el id del
+# trabajo y se ejecutan en un pool de hilos acotado del propio worker. El estado se
+# guarda en la tabla Job, así que cualquier worker puede responder a la consulta de
+# estado, y los trabajos interrumpidos por un reinicio se retoman. El resultado se
+# escribe por partes en un archivo de JOB_RESULTS_DIR (compartido por los workers
+# del host), así las exportaciones grandes no pasan enteras por la memoria.
+app.config.setdefault('JOB_WORKERS', int(os.environ.get('JOB_WORKERS', 2)))
+app.config.setdefault('JOB_MAX_PENDING', int(os.environ.get('JOB_MAX_PENDING', 20)))
+app.config.setdefault('JOB_STALE_SECONDS', int(os.environ.get('JOB_STALE_SECONDS', 3600)))
+app.config.setdefault('JOB_RETENTION_DAYS', int(os.environ.get('JOB_RETENTION_DAYS', 7)))
+app.config.setdefault('JOB_RESULTS_DIR', os.environ.get('JOB_RESULTS_DIR', os.path.join(app.instance_path, 'job_results')))
+JOB_WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+job_executor = None
+job_lock = threading.Lock()
+pending_jobs = 0
+
+def get_job_executor():
+    """Crea el pool al primer uso (después del fork de gunicorn); su primera tarea retoma
+    los trabajos pendientes, fuera de la petición que lo creó"""
+    global job_executor
+    with job_lock:
+        if job_executor is None:
+            job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+            job_executor.submit(resume_jobs)
+    return job_executor
+
+def worker_alive(worker):
+    """False si `worker` es un proceso de este host que ya no existe; None si no se puede saber"""
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def job_result_path(job_id):
+    return os.path.join(app.config['JOB_RESULTS_DIR'], job_id)
+
+def remove_job_result(job_id):
+    for path in (job_result_path(job_id), job_result_path(job_id) + '.tmp'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def resume_jobs():
+    """Vuelve a encolar los trabajos de workers caídos y ejecuta los que siguen en cola"""
+    now = datetime.now()
+    stale = now - timedelta(seconds=app.config['JOB_STALE_SECONDS'])
+    try:
+        with app.app_context():
+            expired = db.session.execute(db.delete(Job).where(
+                Job.status.in_(['done', 'failed']),
+                Job.finished_at < now - timedelta(days=app.config['JOB_RETENTION_DAYS'])
+            ).returning(Job.id)).scalars().all()
+            for job in Job.query.filter_by(status='running').all():
+                if worker_alive(job.worker) is False or job.started_at < stale:
+                    db.session.execute(db.update(Job).where(
+                        Job.id == job.id, Job.status == 'running', Job.worker == job.worker
+                    ).values(status='queued', worker=None))
+            db.session.commit()
+            for job_id in expired:
+                remove_job_result(job_id)
+            
+            queued = [job_id for job_id, in db.session.query(Job.id).filter_by(status='queued').order_by(Job.created_at)]
+    except Exception as e:
+        print("❌ Error al retomar trabajos pendientes:", str(e))
+        return
+    
+    for job_id in queued:
+        enqueue_job(job_id)
+
+def enqueue_job(job_id):
+    global pending_jobs
+    with job_lock:
+        pending_jobs += 1
+    job_executor.submit(execute_job, job_id)
+
+def execute_job(job_id):
+    global pending_jobs
+    try:
+        with app.app_context():
+            run_job(job_id)
+    except Exception as e:
+        print(f"❌ Error en el trabajo {job_id}:", str(e))
+    finally:
+        with job_lock:
+            pending_jobs -= 1
+
+def run_job(job_id):
+    # Solo un worker puede tomar el trabajo (compare-and-set sobre el estado)
+    claimed = db.session.execute(db.update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+        status='running', worker=JOB_WORKER_ID, started_at=datetime.now(), attempts=Job.attempts + 1
+    )).rowcount
+    db.session.commit()
+    if not claimed:
+        return
+    
+    job = db.session.get(Job, job_id)
+    params = json.loads(job.params)
+    path = job_result_path(job_id)
+    try:
+        with app.test_request_context(job.path, method=params['method'], query_string=params['args'], json=params['body']):
+            response = app.make_response(app.view_functions[job.endpoint](**params['view_args']))
+            # Las exportaciones en streaming se copian al archivo por partes
+            os.makedirs(app.config['JOB_RESULTS_DIR'], exist_ok=True)
+            try:
+                with open(path + '.tmp', 'wb') as result:
+                    for chunk in response.iter_encoded():
+                        result.write(chunk)
+            finally:
+                response.close()
+            os.replace(path + '.tmp', path)
+        
+        disposition = response.headers.get('Content-Disposition', '')
+        values = {
+            'status': 'done' if response.status_code < 400 else 'failed',
+            'result_status': response.status_code,
+            'result_mimetype': response.content_type,
+            'result_filename': disposition.partition('filename=')[2] or None
+        }
+    except Exception as e:
+        db.session.rollback()
+        remove_job_result(job_id)
+        values = {'status': 'failed', 'error': str(e)}
+    
+    db.session.execute(db.update(Job).where(Job.id == job_id).values(finished_at=datetime.now(), **values))
+    db.session.commit()
+
+def submit_job(view_args):
+    executor = get_job_executor()
+    if pending_jobs >= app.config['JOB_MAX_PENDING']:
+        return jsonify({'success': False, 'error': 'Hay demasiados trabajos en cola, intente más tarde'}), 503
+    
+    args = [(key, value) for key, value in request.args.items(multi=True) if key != 'async']
+    job = Job(
+        id=uuid.uuid4().hex,
+        endpoint=request.endpoint,
+        path=request.path,
+        params=json.dumps({
+            'method': request.method,
+            'view_args': view_args,
+            'args': args,
+            'body': request.get_json(silent=True)
+        }),
+        user_id=session.get('user_id')
+    )
+    db.session.add(job)
+    db.session.commit()
+    enqueue_job(job.id)
+    
+    return jsonify({'success': True, 'job_id': job.id, 'status_url': f'/api/jobs/{job.id}'}), 202
+
+def background_job(view):
+    """Con ?async=1 ejecuta la ruta como trabajo en segundo plano (ver /api/jobs/<id>)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get('async') != '1':
+            return view(*args, **kwargs)
+        return submit_job(kwargs)
+    return wrapper
+
+def get_user_job(job_id):
+    """Trabajo `job_id` si pertenece al usuario de la sesión (o es administrador)"""
+    job = db.session.get(Job, job_id)
+    if job is None or (job.user_id != session.get('user_id') and not is_admin_session()):
+        return None
+    return job
+
+@app.route('/api/jobs')
+@query_budget(1)
+def list_jobs():
+    get_job_executor()
+    query = Job.query
+    if not is_admin_session():
+        query = query.filter(Job.user_id == session.get('user_id'))
+    jobs = query.order_by(Job.created_at.desc()).limit(50).all()
+    return jsonify({'success': True, 'data': JOB_SERIALIZER.many(jobs)})
+
+@app.route('/api/jobs/<job_id>')
+@query_budget(1)
+def job_status(job_id):
+    get_job_executor()
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': JOB_SERIALIZER(job)})
+
+@app.route('/api/jobs/<job_id>/result')
+@query_budget(1)
+def job_result(job_id):
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    if job.status in ('queued', 'running'):
+        return jsonify({'success': False, 'error': 'El trabajo aún no terminó', 'status': job.status}), 409
+    if job.result_status is None:
+        return jsonify({'success': False, 'error': job.error or 'El trabajo falló'}), 500
+    
+    path = job_result_path(job.id)
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'El resultado ya no está disponible'}), 410
+    
+    # Se envía por partes desde el disco, con el mismo Content-Type de la respuesta original
+    response = Response(
+        wrap_file(request.environ, open(path, 'rb')),
+        status=job.result_status, content_type=job.result_mimetype, direct_passthrough=True
+    )
+    if job.result_filename:
+        response.headers['Content-Disposition'] = f'attachment; filename={job.result_filename}'
+    return response
+
+# === COMPRESIÓN Y ARCHIVOS ESTÁTICOS ===
+# Las respuestas de texto (JSON, HTML, CSV...) se comprimen con brotli o gzip según
+# Accept-Encoding. Los estáticos se sirven desde memoria con sus variantes ya
+# comprimidas, y url_for('static') agrega el hash del contenido al nombre
+# (style.<hash>.css) para que el navegador los guarde sin revalidar.
+app.config.setdefault('COMPRESS_MIN_SIZE', int(os.environ.get('COMPRESS_MIN_SIZE', 1024)))
+app.config.setdefault('COMPRESS_LEVEL', int(os.environ.get('COMPRESS_LEVEL', 6)))
+app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5)))
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+    'text/css', 'text/csv', 'text/html', 'text/javascript', 'text/plain', 'text/xml'
+}
+STATIC_MAX_AGE = 365 * 24 * 3600
+STATIC_FINGERPRINT_RE = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)?$')
+
+def compress(data, encoding, static=False):
+    """Comprime `data`; los estáticos usan el nivel máximo porque se comprimen una sola vez"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=9 if static else app.config['COMPRESS_LEVEL'], mtime=0)
+
+def accepted_encoding(available):
+    """Codificación preferida por el cliente entre `available` (None si no acepta ninguna)"""
+    return request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in available])
+
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    
+    # La representación depende de Accept-Encoding aunque esta vez no se comprima
+    response.vary.add('Accept-Encoding')
+    if response.calculate_content_length() < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    encoding = accepted_encoding(('br', 'gzip') if brotli else ('gzip',))
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+class StaticAsset:
+    """Archivo de static/ en memoria con su hash y sus variantes comprimidas"""
+    def __init__(self, path, mtime):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = mtime
+        self.digest = hashlib.sha256(self.data).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        
+        # Solo se guardan las variantes que realmente reducen el tamaño (un PNG no se comprime)
+        self.variants = {}
+        if self.mimetype in COMPRESS_MIMETYPES and len(self.data) >= app.config['COMPRESS_MIN_SIZE']:
+            for encoding in (('br', 'gzip') if brotli else ('gzip',)):
+                compressed = compress(self.data, encoding, static=True)
+                if len(compressed) < len(self.data):
+                    self.variants[encoding] = compressed
+
+static_assets = {}
+static_assets_lock = threading.Lock()
+
+def get_static_asset(filename):
+    path = safe_join(app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        return None
+    
+    mtime = os.stat(path).st_mtime_ns
+    asset = static_assets.get(filename)
+    if asset is None or asset.mtime != mtime:
+        with static_assets_lock:
+            asset = static_assets[filename] = StaticAsset(path, mtime)
+    return asset
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    """url_for('static', filename='style.css') -> /static/style.<hash>.css"""
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    asset = get_static_asset(values['filename'])
+    if asset:
+        name, extension = os.path.splitext(values['filename'])
+        values['filename'] = f'{name}.{asset.digest}{extension}'
+
+@app.endpoint('static')
+def static_file(filename):
+    asset = get_static_asset(filename)
+    fingerprinted = False
+    if asset is None:
+        match = STATIC_FINGERPRINT_RE.match(filename)
+        if match:
+            asset = get_static_asset(match.group(1) + (match.group(3) or ''))
+            # Un hash antiguo (despliegue anterior) recibe el contenido actual sin caché larga
+            fingerprinted = asset is not None and asset.digest == match.group(2)
+    if asset is None:
+        return Response('Not Found', status=404, mimetype='text/plain')
+    
+    encoding = accepted_encoding(asset.variants)
+    response = Response(asset.variants[encoding] if encoding else asset.data, mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    
+    response.set_etag(asset.digest + ('-' + encoding if encoding else ''))
+    response.last_modified = asset.mtime / 1e9
+    if fingerprinted:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 # === TODAS TUS RUTAS (EXACTAMENTE IGUAL) ===
 @app.route('/')
 def login_page():
@@ -343,33 +1446,31 @@ def login():
 # ... (TODAS TUS DEMÁS APIs EXACTAMENTE IGUALES - las copias de tu archivo original)
 # APIS PARA CONFIGURACIÓN
 @app.route('/api/school-years', methods=['GET', 'POST'])
+@query_budget(2)
+@etag_response('school_year')
 def school_years():
     if request.method == 'GET':
         years = SchoolYear.query.all()
-        return jsonify([{
-            'id': y.id, 'year': y.year, 
-            'start_date': y.start_date, 'end_date': y.end_date
-        } for y in years])
+        return jsonify(SCHOOL_YEAR_SERIALIZER.many(years))
     
     elif request.method == 'POST':
         data = request.get_json()
         year = SchoolYear(
             year=data['year'],
-            start_date=data['start_date'],
-            end_date=data['end_date']
+            start_date=parse_date(data['start_date']),
+            end_date=parse_date(data['end_date'])
         )
         db.session.add(year)
         db.session.commit()
         return jsonify({'success': True})
 
 @app.route('/api/classrooms', methods=['GET', 'POST'])
+@query_budget(2)
+@etag_response('classroom')
 def classrooms():
     if request.method == 'GET':
         classrooms = Classroom.query.all()
-        return jsonify([{
-            'id': c.id, 'name': c.name, 'age_range': c.age_range,
-            'capacity': c.capacity, 'current_students': c.current_students
-        } for c in classrooms])
+        return jsonify(CLASSROOM_SERIALIZER.many(classrooms))
     
     elif request.method == 'POST':
         data = request.get_json()
@@ -383,13 +1484,12 @@ def classrooms():
         return jsonify({'success': True})
 
 @app.route('/api/payment-concepts', methods=['GET', 'POST'])
+@query_budget(2)
+@etag_response('payment_concept')
 def payment_concepts():
     if request.method == 'GET':
         concepts = PaymentConcept.query.all()
-        return jsonify([{
-            'id': c.id, 'name': c.name, 'description': c.description,
-            'amount': c.amount, 'frequency': c.frequency
-        } for c in concepts])
+        return jsonify(PAYMENT_CONCEPT_SERIALIZER.many(concepts))
     
     elif request.method == 'POST':
         data = request.get_json()
@@ -404,101 +1504,130 @@ def payment_concepts():
         return jsonify({'success': True})
 
 # APIS PARA ESTUDIANTES - CORREGIDAS
+@app.route('/api/students/import', methods=['POST'])
+def import_students():
+    """Importación masiva de estudiantes desde CSV o JSON Lines"""
+    try:
+        upload = request.files.get('file')
+        stream = upload.stream if upload else request.stream
+        filename = upload.filename if upload else ''
+        
+        file_format = request.args.get('format')
+        if not file_format:
+            is_jsonl = filename.lower().endswith(('.jsonl', '.ndjson')) or 'json' in (request.mimetype or '')
+            file_format = 'jsonl' if is_jsonl else 'csv'
+        if file_format not in ('csv', 'jsonl'):
+            return jsonify({'success': False, 'error': 'Formato no soportado (use csv o jsonl)'}), 400
+        
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        rows = csv.DictReader(text) if file_format == 'csv' else iter_jsonl(text)
+        
+        # Todos los DNI registrados en una sola consulta
+        known_dnis = set(db.session.execute(db.select(Student.dni)).scalars())
+        
+        imported = 0
+        errors = []
+        batch = []
+        for line, data in enumerate(rows, start=1):
+            try:
+                if not isinstance(data, dict):
+                    raise ValueError('Fila inválida')
+                missing = missing_student_field(data)
+                if missing:
+                    raise ValueError(f'Campo requerido faltante: {missing}')
+                dni = str(data['dni']).strip()
+                if dni in known_dnis:
+                    raise ValueError('El DNI ya está registrado')
+                values = student_values(dict(data, dni=dni))
+            except ValueError as e:
+                errors.append({'row': line, 'dni': data.get('dni') if isinstance(data, dict) else None, 'error': str(e)})
+                continue
+            
+            known_dnis.add(dni)
+            batch.append(values)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                db.session.execute(db.insert(Student), batch)
+                imported += len(batch)
+                batch = []
+        
+        if batch:
+            db.session.execute(db.insert(Student), batch)
+            imported += len(batch)
+        
+        # Una sola transacción: si falla un lote no queda una importación a medias
+        db.session.commit()
+        print(f"✅ Importación de estudiantes: {imported} creados, {len(errors)} con errores")
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'failed': len(errors),
+            'errors': errors
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/students', methods=['GET', 'POST', 'PUT'])
+@query_budget(1)
 def students():
     try:
         if request.method == 'GET':
-            students = Student.query.all()
-            return jsonify([{
-                'id': s.id,
-                'first_name': s.first_name,
-                'last_name': s.last_name,
-                'dni': s.dni,
-                'birth_date': s.birth_date,
-                'age': calculate_age(s.birth_date),
-                'gender': s.gender,
-                'phone': s.phone,
-                'status': s.status
-            } for s in students])
+            try:
+                fields = parse_student_fields(request.args.get('fields'), STUDENT_LIST_FIELDS)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            
+            # Sin parámetros de paginación se mantiene la respuesta antigua (lista completa)
+            if 'limit' not in request.args and 'cursor' not in request.args:
+                students = Student.query.options(student_load_options(fields)).order_by(Student.last_name, Student.id).all()
+                return jsonify(student_serializer(tuple(fields)).many(students))
+            
+            try:
+                limit = min(max(int(request.args.get('limit', STUDENTS_PAGE_SIZE)), 1), STUDENTS_MAX_PAGE_SIZE)
+                cursor = decode_cursor(request.args.get('cursor'))
+                # last_name siempre se carga porque forma parte del cursor
+                query = filter_students_query(
+                    Student.query.options(student_load_options(fields + ['last_name'])), request.args
+                )
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Parámetros de búsqueda inválidos'}), 400
+            
+            # Paginación keyset: (apellido, id) del último registro de la página anterior
+            if cursor:
+                last_name, last_id = cursor[0], int(cursor[1])
+                query = query.filter(db.or_(
+                    Student.last_name > last_name,
+                    db.and_(Student.last_name == last_name, Student.id > last_id)
+                ))
+            
+            students = query.order_by(Student.last_name, Student.id).limit(limit + 1).all()
+            
+            next_cursor = None
+            if len(students) > limit:
+                students = students[:limit]
+                next_cursor = encode_cursor([students[-1].last_name, students[-1].id])
+            
+            return jsonify({
+                'success': True,
+                'data': student_serializer(tuple(fields)).many(students),
+                'next_cursor': next_cursor
+            })
         
         elif request.method == 'POST':
             data = request.get_json()
             print("Datos recibidos para nuevo estudiante:", data)  # DEBUG
             
             # Validar campos requeridos
-            required_fields = ['last_name', 'first_name', 'dni', 'birth_date', 'gender', 'address', 'phone']
-            for field in required_fields:
-                if not data.get(field):
-                    return jsonify({'success': False, 'error': f'Campo requerido faltante: {field}'}), 400
+            missing = missing_student_field(data)
+            if missing:
+                return jsonify({'success': False, 'error': f'Campo requerido faltante: {missing}'}), 400
             
             # Verificar si DNI ya existe
             existing_student = Student.query.filter_by(dni=data['dni']).first()
             if existing_student:
                 return jsonify({'success': False, 'error': 'El DNI ya está registrado'}), 400
             
-            # Convertir valores numéricos
-            height = data.get('height')
-            weight = data.get('weight')
-            
-            if height:
-                try:
-                    height = float(height)
-                except (ValueError, TypeError):
-                    height = None
-            
-            if weight:
-                try:
-                    weight = float(weight)
-                except (ValueError, TypeError):
-                    weight = None
-            
-            student = Student(
-                # Información Personal
-                last_name=data['last_name'],
-                first_name=data['first_name'],
-                dni=data['dni'],
-                birth_date=data['birth_date'],
-                gender=data['gender'],
-                nationality=data.get('nationality', 'Peruana'),
-                
-                # Información de Contacto
-                address=data['address'],
-                phone=data['phone'],
-                email=data.get('email', ''),
-                
-                # Información del Padre
-                father_names=data.get('father_names', ''),
-                father_dni=data.get('father_dni', ''),
-                father_birth_date=data.get('father_birth_date', ''),
-                father_phone=data.get('father_phone', ''),
-                father_email=data.get('father_email', ''),
-                father_occupation=data.get('father_occupation', ''),
-                
-                # Información de la Madre
-                mother_names=data.get('mother_names', ''),
-                mother_dni=data.get('mother_dni', ''),
-                mother_birth_date=data.get('mother_birth_date', ''),
-                mother_phone=data.get('mother_phone', ''),
-                mother_email=data.get('mother_email', ''),
-                mother_occupation=data.get('mother_occupation', ''),
-                
-                # Contacto de Emergencia
-                emergency_contact=data.get('emergency_contact', ''),
-                emergency_relationship=data.get('emergency_relationship', ''),
-                emergency_phone=data.get('emergency_phone', ''),
-                emergency_address=data.get('emergency_address', ''),
-                
-                # Datos Médicos
-                blood_type=data.get('blood_type', ''),
-                height=height,
-                weight=weight,
-                allergies=data.get('allergies', ''),
-                medications=data.get('medications', ''),
-                medical_conditions=data.get('medical_conditions', ''),
-                activity_restrictions=data.get('activity_restrictions', ''),
-                vaccines_up_to_date=data.get('vaccines_up_to_date', True),
-                medical_observations=data.get('medical_observations', '')
-            )
+            student = Student(**student_values(data))
             
             db.session.add(student)
             db.session.commit()
@@ -527,9 +1656,12 @@ def students():
                 'activity_restrictions', 'vaccines_up_to_date', 'medical_observations', 'status'
             ]
             
+            date_fields = ['birth_date', 'father_birth_date', 'mother_birth_date']
+            
             for field in updatable_fields:
                 if field in data:
-                    setattr(student, field, data[field])
+                    value = parse_date(data[field]) if field in date_fields else data[field]
+                    setattr(student, field, value)
             
             db.session.commit()
             return jsonify({'success': True})
@@ -540,77 +1672,99 @@ def students():
 
 # API para obtener estudiante por ID
 @app.route('/api/students/<int:student_id>', methods=['GET'])
+@query_budget(1)
 def get_student(student_id):
     try:
-        student = Student.query.get(student_id)
+        fields = parse_student_fields(request.args.get('fields'), STUDENT_DETAIL_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        student = db.session.get(Student, student_id, options=[student_load_options(fields)])
         if not student:
             return jsonify({'success': False, 'error': 'Estudiante no encontrado'}), 404
         
         return jsonify({
             'success': True,
-            'student': {
-                'id': student.id,
-                'last_name': student.last_name,
-                'first_name': student.first_name,
-                'dni': student.dni,
-                'birth_date': student.birth_date,
-                'gender': student.gender,
-                'nationality': student.nationality,
-                'address': student.address,
-                'phone': student.phone,
-                'email': student.email,
-                'father_names': student.father_names,
-                'father_dni': student.father_dni,
-                'father_birth_date': student.father_birth_date,
-                'father_phone': student.father_phone,
-                'father_email': student.father_email,
-                'father_occupation': student.father_occupation,
-                'mother_names': student.mother_names,
-                'mother_dni': student.mother_dni,
-                'mother_birth_date': student.mother_birth_date,
-                'mother_phone': student.mother_phone,
-                'mother_email': student.mother_email,
-                'mother_occupation': student.mother_occupation,
-                'emergency_contact': student.emergency_contact,
-                'emergency_relationship': student.emergency_relationship,
-                'emergency_phone': student.emergency_phone,
-                'emergency_address': student.emergency_address,
-                'blood_type': student.blood_type,
-                'height': student.height,
-                'weight': student.weight,
-                'allergies': student.allergies,
-                'medications': student.medications,
-                'medical_conditions': student.medical_conditions,
-                'activity_restrictions': student.activity_restrictions,
-                'vaccines_up_to_date': student.vaccines_up_to_date,
-                'medical_observations': student.medical_observations,
-                'status': student.status,
-                'enrollment_date': student.enrollment_date
-            }
+            'student': student_serializer(tuple(fields))(student)
         })
         
     except Exception as e:
         print("Error en /api/students/<id>:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Búsqueda aproximada por nombre o DNI (del alumno o de sus padres)
+@app.route('/api/students/search')
+@query_budget(3)
+def search_students_api():
+    q = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+        fields = parse_student_fields(request.args.get('fields'), STUDENT_LIST_FIELDS)
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if len(normalize_search_text(q)) < 3:
+        return jsonify({'success': False, 'error': 'La búsqueda requiere al menos 3 caracteres'}), 400
+    
+    try:
+        ranked = search_students(q, limit)
+        serialize = student_serializer(tuple(fields))
+        students = {
+            s.id: s for s in Student.query.options(student_load_options(fields))
+            .filter(Student.id.in_([student_id for student_id, _ in ranked]))
+        }
+        return jsonify({
+            'success': True,
+            'data': [
+                dict(serialize(students[student_id]), score=round(score, 3))
+                for student_id, score in ranked if student_id in students
+            ]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # API PARA DASHBOARD
 @app.route('/api/dashboard-stats')
+@query_budget(2)
+@cached_response('school_year', 'classroom', 'payment_concept', 'student')
 def dashboard_stats():
-    total_years = SchoolYear.query.count()
-    total_classrooms = Classroom.query.count()
-    total_concepts = PaymentConcept.query.count()
-    total_students = Student.query.count()
+    return jsonify(dashboard_counters())
+
+# FLUJO EN VIVO: OCUPACIÓN DE AULAS Y CONTADORES DEL DASHBOARD
+@app.route('/api/live/events')
+def live_events_stream():
+    """Server-Sent Events: 'snapshot' al conectar y luego 'delta' con lo que cambió"""
+    try:
+        events = live_events.subscribe()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if events is None:
+        return jsonify({'success': False, 'error': 'Demasiadas conexiones en vivo, intente más tarde'}), 503
     
-    return jsonify({
-        'school_years': total_years,
-        'classrooms': total_classrooms,
-        'payment_concepts': total_concepts,
-        'students': total_students,
-        'setup_complete': total_years > 0 and total_classrooms > 0 and total_concepts > 0
-    })
+    keepalive = app.config['LIVE_EVENTS_KEEPALIVE']
+    max_age = app.config['LIVE_EVENTS_MAX_AGE']
+    
+    def stream():
+        # Pasado max_age se cierra el flujo y el navegador reconecta (libera el hilo y revalida la sesión)
+        deadline = time.monotonic() + max_age
+        try:
+            yield f"retry: {LIVE_EVENTS_RETRY_MS}\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    yield events.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            live_events.unsubscribe(events)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # APIS PARA MATRÍCULAS
 @app.route('/api/enrollments', methods=['GET', 'POST'])
+@query_budget(1)
 def enrollments():
     if request.method == 'GET':
         enrollments = Enrollment.query.options(
@@ -618,16 +1772,7 @@ def enrollments():
             db.joinedload(Enrollment.classroom)
         ).all()
         
-        return jsonify([{
-            'id': e.id,
-            'student_id': e.student_id,
-            'student_name': f"{e.student.first_name} {e.student.last_name}",
-            'student_dni': e.student.dni,
-            'classroom_id': e.classroom_id,
-            'classroom_name': e.classroom.name,
-            'enrollment_date': e.enrollment_date,
-            'status': e.status
-        } for e in enrollments])
+        return jsonify(ENROLLMENT_SERIALIZER.many(enrollments))
     
     elif request.method == 'POST':
         try:
@@ -643,20 +1788,15 @@ def enrollments():
             if existing_enrollment:
                 return jsonify({'success': False, 'error': 'El estudiante ya está matriculado'})
             
-            # Verificar capacidad del aula
-            classroom = Classroom.query.get(data['classroom_id'])
-            current_enrollments = Enrollment.query.filter_by(
-                classroom_id=data['classroom_id'], 
-                status='active'
-            ).count()
-            
-            if current_enrollments >= classroom.capacity:
+            # Reservar cupo en el aula (falla si está llena)
+            if not reserve_classroom_spot(data['classroom_id']):
+                db.session.rollback()
                 return jsonify({'success': False, 'error': 'El aula no tiene cupos disponibles'})
             
             enrollment = Enrollment(
                 student_id=data['student_id'],
                 classroom_id=data['classroom_id'],
-                enrollment_date=data.get('enrollment_date')
+                enrollment_date=parse_date(data.get('enrollment_date')) or date.today()
             )
             
             db.session.add(enrollment)
@@ -665,43 +1805,102 @@ def enrollments():
             return jsonify({'success': True, 'enrollment_id': enrollment.id})
             
         except Exception as e:
+            db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
 
-# API PARA GENERAR CONSTANCIA DE MATRÍCULA
-@app.route('/api/enrollments/<int:enrollment_id>/certificate')
-def generate_certificate(enrollment_id):
+@app.route('/api/enrollments/batch', methods=['POST'])
+def enroll_batch():
+    """Matricula varios estudiantes en un aula en una sola transacción"""
     try:
-        enrollment = Enrollment.query.options(
-            db.joinedload(Enrollment.student),
+        data = request.get_json() or {}
+        classroom_id = data.get('classroom_id')
+        student_ids = data.get('student_ids')
+        
+        if not classroom_id or not isinstance(student_ids, list) or not student_ids:
+            return jsonify({'success': False, 'error': 'Se requiere classroom_id y una lista student_ids'}), 400
+        if not db.session.get(Classroom, classroom_id):
+            return jsonify({'success': False, 'error': 'Aula no encontrada'}), 404
+        
+        enrollment_date = parse_date(data.get('enrollment_date')) or date.today()
+        
+        results = OrderedDict()
+        candidates = []
+        for raw_id in student_ids:
+            try:
+                student_id = int(raw_id)
+            except (ValueError, TypeError):
+                results[str(raw_id)] = {'student_id': raw_id, 'success': False, 'error': 'ID de estudiante inválido'}
+                continue
+            if student_id not in results:
+                results[student_id] = None
+                candidates.append(student_id)
+        
+        # Una consulta IN para estudiantes existentes y otra para matrículas activas
+        found = set(db.session.execute(
+            db.select(Student.id).where(Student.id.in_(candidates))
+        ).scalars())
+        enrolled = set(db.session.execute(
+            db.select(Enrollment.student_id).where(
+                Enrollment.student_id.in_(candidates),
+                Enrollment.status == 'active'
+            )
+        ).scalars())
+        
+        pending = []
+        for student_id in candidates:
+            if student_id not in found:
+                results[student_id] = {'student_id': student_id, 'success': False, 'error': 'Estudiante no encontrado'}
+            elif student_id in enrolled:
+                results[student_id] = {'student_id': student_id, 'success': False, 'error': 'El estudiante ya está matriculado'}
+            else:
+                pending.append(student_id)
+        
+        # Reserva atómica de cupos; los que no alcanzan quedan fuera en el orden recibido
+        reserved = reserve_classroom_spots(classroom_id, len(pending))
+        new_enrollments = [
+            Enrollment(student_id=student_id, classroom_id=classroom_id, enrollment_date=enrollment_date)
+            for student_id in pending[:reserved]
+        ]
+        for student_id in pending[reserved:]:
+            results[student_id] = {'student_id': student_id, 'success': False, 'error': 'El aula no tiene cupos disponibles'}
+        
+        db.session.add_all(new_enrollments)
+        db.session.commit()
+        
+        for enrollment in new_enrollments:
+            results[enrollment.student_id] = {
+                'student_id': enrollment.student_id,
+                'success': True,
+                'enrollment_id': enrollment.id
+            }
+        
+        return jsonify({
+            'success': True,
+            'enrolled': len(new_enrollments),
+            'failed': len(results) - len(new_enrollments),
+            'results': list(results.values())
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# API PARA GENERAR CONSTANCIA DE MATRÍCULA
+@app.route('/api/enrollments/<int:enrollment_id>/certificate')
+@query_budget(1)
+def generate_certificate(enrollment_id):
+    try:
+        enrollment = Enrollment.query.options(
+            db.joinedload(Enrollment.student),
             db.joinedload(Enrollment.classroom)
         ).get(enrollment_id)
         
         if not enrollment:
             return jsonify({'success': False, 'error': 'Matrícula no encontrada'}), 404
         
-        # Formatear fecha de matrícula
-        try:
-            enrollment_date = datetime.strptime(enrollment.enrollment_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-        except:
-            enrollment_date = enrollment.enrollment_date
-            
-        try:
-            birth_date = datetime.strptime(enrollment.student.birth_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-        except:
-            birth_date = enrollment.student.birth_date
-        
-        # Datos para la constancia
-        certificate_data = {
-            'enrollment_id': enrollment.id,
-            'student_name': f"{enrollment.student.first_name} {enrollment.student.last_name}",
-            'student_dni': enrollment.student.dni,
-            'student_birth_date': birth_date,
-            'classroom_name': enrollment.classroom.name,
-            'classroom_age_range': enrollment.classroom.age_range,
-            'enrollment_date': enrollment_date,
-            'current_date': datetime.now().strftime('%d/%m/%Y'),
-            'current_year': datetime.now().year
-        }
+        # Datos para la constancia (fechas en formato dd/mm/aaaa)
+        certificate_data = CERTIFICATE_SERIALIZER(enrollment)
+        certificate_data['current_date'] = format_short_date(datetime.now())
+        certificate_data['current_year'] = datetime.now().year
         
         return jsonify({
             'success': True, 
@@ -714,72 +1913,52 @@ def generate_certificate(enrollment_id):
 
 # API para estudiantes no matriculados
 @app.route('/api/students/unenrolled')
+@query_budget(1)
 def unenrolled_students():
+    try:
+        fields = parse_student_fields(request.args.get('fields'), STUDENT_UNENROLLED_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
     try:
         # Estudiantes que no tienen matrículas activas
         enrolled_student_ids = db.session.query(Enrollment.student_id).filter_by(status='active')
-        unenrolled_students = Student.query.filter(
+        unenrolled_students = Student.query.options(student_load_options(fields)).filter(
             Student.status == 'active',
             ~Student.id.in_(enrolled_student_ids)
         ).all()
         
-        return jsonify([{
-            'id': s.id,
-            'first_name': s.first_name,
-            'last_name': s.last_name,
-            'dni': s.dni,
-            'birth_date': s.birth_date,
-            'age': calculate_age(s.birth_date)
-        } for s in unenrolled_students])
+        return jsonify(student_serializer(tuple(fields)).many(unenrolled_students))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API para aulas disponibles
 @app.route('/api/classrooms/available')
+@query_budget(1)
 def available_classrooms():
     try:
         classrooms = Classroom.query.filter_by(status='active').all()
         
-        result = []
-        for classroom in classrooms:
-            current_enrollments = Enrollment.query.filter_by(
-                classroom_id=classroom.id, 
-                status='active'
-            ).count()
-            
-            result.append({
-                'id': classroom.id,
-                'name': classroom.name,
-                'age_range': classroom.age_range,
-                'capacity': classroom.capacity,
-                'current_enrollments': current_enrollments,
-                'available_spots': classroom.capacity - current_enrollments
-            })
-        
-        return jsonify(result)
+        # current_students se mantiene al matricular, anular o cambiar de aula
+        return jsonify(AVAILABLE_CLASSROOM_SERIALIZER.many(classrooms))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # API PARA ESTUDIANTES MATRICULADOS
 @app.route('/api/students/enrolled')
+@query_budget(2)
+@etag_response('enrollment', 'student', 'classroom')
 def enrolled_students():
     try:
-        # Obtener matrículas activas
-        enrollments = Enrollment.query.filter_by(status='active').all()
-        
-        result = []
-        for enrollment in enrollments:
-            student = enrollment.student
-            result.append({
-                'id': student.id,
-                'name': f"{student.first_name} {student.last_name}",
-                'dni': student.dni,
-                'classroom': enrollment.classroom.name
-            })
+        # Obtener matrículas activas (alumno y aula en la misma consulta)
+        enrollments = Enrollment.query.options(
+            db.joinedload(Enrollment.student),
+            db.joinedload(Enrollment.classroom)
+        ).filter_by(status='active').all()
         
-        return jsonify(result)
+        return jsonify(ENROLLED_STUDENT_SERIALIZER.many(enrollments))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -788,6 +1967,7 @@ def enrolled_students():
 
 # Ver detalles de matrícula
 @app.route('/api/enrollments/<int:enrollment_id>/details')
+@query_budget(1)
 def get_enrollment_details(enrollment_id):
     """API para el botón VER matrícula"""
     try:
@@ -801,15 +1981,7 @@ def get_enrollment_details(enrollment_id):
         
         return jsonify({
             'success': True,
-            'enrollment': {
-                'id': enrollment.id,
-                'student_name': f"{enrollment.student.first_name} {enrollment.student.last_name}",
-                'student_dni': enrollment.student.dni,
-                'classroom_name': enrollment.classroom.name,
-                'classroom_id': enrollment.classroom_id,
-                'enrollment_date': enrollment.enrollment_date,
-                'status': enrollment.status
-            }
+            'enrollment': ENROLLMENT_DETAIL_SERIALIZER(enrollment)
         })
         
     except Exception as e:
@@ -818,6 +1990,7 @@ def get_enrollment_details(enrollment_id):
 
 # Obtener matrícula para editar
 @app.route('/api/enrollments/<int:enrollment_id>/edit')
+@query_budget(1)
 def get_enrollment_for_edit(enrollment_id):
     """API para el botón EDITAR matrícula"""
     try:
@@ -831,15 +2004,7 @@ def get_enrollment_for_edit(enrollment_id):
         
         return jsonify({
             'success': True,
-            'enrollment': {
-                'id': enrollment.id,
-                'student_id': enrollment.student_id,
-                'student_name': f"{enrollment.student.first_name} {enrollment.student.last_name}",
-                'classroom_id': enrollment.classroom_id,
-                'classroom_name': enrollment.classroom.name,
-                'enrollment_date': enrollment.enrollment_date,
-                'status': enrollment.status
-            }
+            'enrollment': ENROLLMENT_EDIT_SERIALIZER(enrollment)
         })
         
     except Exception as e:
@@ -862,19 +2027,16 @@ def update_enrollment(enrollment_id):
         if not new_classroom:
             return jsonify({'success': False, 'error': 'Aula no encontrada'}), 404
         
-        # Si se cambia de aula, verificar capacidad
-        if enrollment.classroom_id != data['classroom_id']:
-            current_enrollments = Enrollment.query.filter_by(
-                classroom_id=data['classroom_id'], 
-                status='active'
-            ).count()
-            
-            if current_enrollments >= new_classroom.capacity:
+        # Si se cambia de aula, mover el cupo (solo las matrículas activas ocupan cupo)
+        if enrollment.classroom_id != new_classroom.id and enrollment.status == 'active':
+            if not reserve_classroom_spot(new_classroom.id):
+                db.session.rollback()
                 return jsonify({'success': False, 'error': 'El aula no tiene cupos disponibles'}), 400
+            release_classroom_spot(enrollment.classroom_id)
         
         # Actualizar campos
-        enrollment.classroom_id = data['classroom_id']
-        enrollment.enrollment_date = data['enrollment_date']
+        enrollment.classroom_id = new_classroom.id
+        enrollment.enrollment_date = parse_date(data['enrollment_date'])
         
         db.session.commit()
         
@@ -895,7 +2057,9 @@ def cancel_enrollment(enrollment_id):
         if not enrollment:
             return jsonify({'success': False, 'error': 'Matrícula no encontrada'}), 404
         
-        # Cambiar estado a inactivo
+        # Cambiar estado a inactivo y liberar el cupo
+        if enrollment.status == 'active':
+            release_classroom_spot(enrollment.classroom_id)
         enrollment.status = 'inactive'
         
         db.session.commit()
@@ -909,6 +2073,7 @@ def cancel_enrollment(enrollment_id):
 
 # API PARA PAGOS
 @app.route('/api/payments', methods=['GET', 'POST'])
+@query_budget(1)
 def payments():
     if request.method == 'GET':
         payments = Payment.query.options(
@@ -916,36 +2081,36 @@ def payments():
             db.joinedload(Payment.concept)
         ).all()
         
-        return jsonify([{
-            'id': p.id,
-            'student_name': f"{p.student.first_name} {p.student.last_name}",
-            'student_dni': p.student.dni,
-            'concept_name': p.concept.name,
-            'amount': p.amount,
-            'payment_date': p.payment_date,
-            'due_date': p.due_date,
-            'status': p.status,
-            'receipt_number': p.receipt_number
-        } for p in payments])
+        return jsonify(PAYMENT_SERIALIZER.many(payments))
     
     elif request.method == 'POST':
         try:
             data = request.get_json()
             
             # Generar número de recibo único
-            import random
-            receipt_number = f"R-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}"
+            receipt_number = next_receipt_number()
             
             payment = Payment(
                 student_id=data['student_id'],
                 concept_id=data['concept_id'],
                 amount=data['amount'],
-                payment_date=data['payment_date'],
-                due_date=data['due_date'],
+                payment_date=parse_date(data['payment_date']),
+                due_date=parse_date(data['due_date']),
                 receipt_number=receipt_number
             )
             
             db.session.add(payment)
+            db.session.flush()
+            
+            # Pago suelto: su cargo y su pago en la cuenta del estudiante
+            entry = {
+                'student_id': payment.student_id,
+                'amount': payment.amount,
+                'entry_date': payment.payment_date,
+                'concept_id': payment.concept_id,
+                'payment_id': payment.id
+            }
+            post_account_entries([dict(entry, kind='cargo'), dict(entry, kind='pago')])
             db.session.commit()
             
             return jsonify({
@@ -955,10 +2120,12 @@ def payments():
             })
             
         except Exception as e:
+            db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
 
 # API PARA COMPROBANTE
 @app.route('/api/payments/<int:payment_id>/receipt')
+@query_budget(1)
 def payment_receipt(payment_id):
     try:
         payment = Payment.query.options(
@@ -969,17 +2136,8 @@ def payment_receipt(payment_id):
         if not payment:
             return jsonify({'success': False, 'error': 'Pago no encontrado'}), 404
         
-        receipt_data = {
-            'receipt_number': payment.receipt_number,
-            'student_name': f"{payment.student.first_name} {payment.student.last_name}",
-            'student_dni': payment.student.dni,
-            'concept_name': payment.concept.name,
-            'amount': payment.amount,
-            'payment_date': payment.payment_date,
-            'due_date': payment.due_date,
-            'status': payment.status,
-            'current_date': datetime.now().strftime('%d/%m/%Y')
-        }
+        receipt_data = RECEIPT_SERIALIZER(payment)
+        receipt_data['current_date'] = format_short_date(datetime.now())
         
         return jsonify({'success': True, 'receipt': receipt_data})
         
@@ -1013,7 +2171,7 @@ def create_payment_plan():
             concept_id=data['concept_id'],
             total_amount=total_amount,
             installments=data['installments'],
-            start_date=data['start_date']
+            start_date=parse_date(data['start_date'])
         )
         
         db.session.add(plan)
@@ -1021,6 +2179,14 @@ def create_payment_plan():
         
         # Generar cuotas
         create_installments(plan, concept.amount)
+        post_account_entries([{
+            'student_id': plan.student_id,
+            'kind': 'cargo',
+            'amount': plan.total_amount,
+            'entry_date': plan.start_date,
+            'concept_id': plan.concept_id,
+            'plan_id': plan.id
+        }])
         
         db.session.commit()
         
@@ -1034,12 +2200,10 @@ def create_payment_plan():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def create_installments(plan, monthly_amount):
-    from datetime import datetime, timedelta
-    
-    start_date = datetime.strptime(plan.start_date, '%Y-%m-%d')
-    
-    for i in range(plan.installments):
+def installment_schedule(start_date, installments):
+    """Fechas de vencimiento de cada cuota: último día de cada mes desde start_date"""
+    due_dates = []
+    for i in range(installments):
         # Fecha emisión: día 1 del mes
         if i == 0:
             emission_date = start_date
@@ -1056,73 +2220,251 @@ def create_installments(plan, monthly_amount):
         else:
             next_month = emission_date.replace(month=emission_date.month + 1, day=1)
         
-        due_date = next_month - timedelta(days=1)
+        due_dates.append(next_month - timedelta(days=1))
+    return due_dates
+
+def installment_rows(plan_id, due_dates, amount):
+    return [{
+        'plan_id': plan_id,
+        'installment_number': number,
+        'due_date': due_date,
+        'amount': amount,
+        'status': 'pending'
+    } for number, due_date in enumerate(due_dates, start=1)]
+
+def create_installments(plan, monthly_amount):
+    due_dates = installment_schedule(plan.start_date, plan.installments)
+    db.session.execute(db.insert(PaymentInstallment), installment_rows(plan.id, due_dates, monthly_amount))
+
+# GENERAR PLANES DE PAGO EN LOTE (AULA O TODAS LAS MATRÍCULAS ACTIVAS)
+@app.route('/api/payment-plans/batch', methods=['POST'])
+@background_job
+def create_payment_plans_batch():
+    try:
+        data = request.get_json() or {}
+        
+        for field in ['concept_id', 'installments']:
+            if not data.get(field):
+                return jsonify({'success': False, 'error': f'Campo faltante: {field}'}), 400
         
-        installment = PaymentInstallment(
-            plan_id=plan.id,
-            installment_number=i + 1,
-            due_date=due_date.strftime('%Y-%m-%d'),
-            amount=monthly_amount,
-            status='pending'
-        )
+        concept = db.session.get(PaymentConcept, data['concept_id'])
+        if not concept:
+            return jsonify({'success': False, 'error': 'Concepto no encontrado'}), 404
         
-        db.session.add(installment)
+        # La fecha de inicio puede venir directa o tomarse del año escolar
+        start_date = parse_date(data.get('start_date'))
+        if not start_date and data.get('school_year_id'):
+            school_year = db.session.get(SchoolYear, data['school_year_id'])
+            if not school_year:
+                return jsonify({'success': False, 'error': 'Año escolar no encontrado'}), 404
+            start_date = school_year.start_date
+        if not start_date:
+            return jsonify({'success': False, 'error': 'Campo faltante: start_date o school_year_id'}), 400
+        
+        installments = int(data['installments'])
+        classroom_id = data.get('classroom_id')
+        
+        # Estudiantes con matrícula activa (del aula, si se indica)
+        targets = db.select(Enrollment.student_id).where(Enrollment.status == 'active').distinct()
+        if classroom_id:
+            targets = targets.where(Enrollment.classroom_id == classroom_id)
+        student_ids = set(db.session.execute(targets).scalars())
+        
+        # Por defecto no se duplica un plan activo del mismo concepto
+        skipped = 0
+        if data.get('skip_existing', True):
+            existing = set(db.session.execute(
+                db.select(PaymentPlan.student_id).where(
+                    PaymentPlan.concept_id == concept.id,
+                    PaymentPlan.status == 'active',
+                    PaymentPlan.student_id.in_(student_ids)
+                )
+            ).scalars())
+            skipped = len(existing)
+            student_ids -= existing
+        
+        # El cronograma se calcula una vez y se reutiliza para todos los planes
+        due_dates = installment_schedule(start_date, installments)
+        total_amount = concept.amount * installments
+        student_ids = sorted(student_ids)
+        
+        for offset in range(0, len(student_ids), PLAN_BATCH_SIZE):
+            chunk = student_ids[offset:offset + PLAN_BATCH_SIZE]
+            plans = db.session.execute(
+                db.insert(PaymentPlan).returning(PaymentPlan.id, PaymentPlan.student_id),
+                [{
+                    'student_id': student_id,
+                    'concept_id': concept.id,
+                    'total_amount': total_amount,
+                    'installments': installments,
+                    'start_date': start_date
+                } for student_id in chunk]
+            ).all()
+            
+            rows = []
+            for plan_id, _ in plans:
+                rows.extend(installment_rows(plan_id, due_dates, concept.amount))
+            db.session.execute(db.insert(PaymentInstallment), rows)
+            post_account_entries([{
+                'student_id': student_id,
+                'kind': 'cargo',
+                'amount': total_amount,
+                'entry_date': start_date,
+                'concept_id': concept.id,
+                'plan_id': plan_id
+            } for plan_id, student_id in plans])
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'created': len(student_ids),
+            'skipped': skipped,
+            'message': f'{len(student_ids)} planes creados con {installments} cuotas'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 # OBTENER PLANES DE PAGO
 @app.route('/api/payment-plans')
+@query_budget(1)
 def get_payment_plans():
     try:
-        plans = PaymentPlan.query.options(
+        pendiente = PaymentInstallment.status != 'paid'
+        mora = PaymentInstallment.late_fee_for_id.isnot(None)
+        
+        # Progreso de cada plan calculado en un solo GROUP BY sobre las cuotas
+        # (las cuotas de mora suman al monto pero no al número de cuotas pagadas)
+        progreso = db.session.query(
+            PaymentInstallment.plan_id.label('plan_id'),
+            db.func.sum(db.case((pendiente, 0), (mora, 0), else_=1)).label('paid_installments'),
+            db.func.sum(db.case((pendiente, 0), else_=PaymentInstallment.amount)).label('paid_amount'),
+            db.func.sum(db.case((pendiente, PaymentInstallment.amount), else_=0)).label('pending_amount'),
+            db.func.min(db.case((pendiente, PaymentInstallment.due_date))).label('next_due_date'),
+            db.func.sum(db.case((PaymentInstallment.status == 'overdue', 1), else_=0)).label('overdue_installments')
+        ).group_by(PaymentInstallment.plan_id).subquery()
+        
+        # Los planes más recientes primero
+        query = db.session.query(PaymentPlan, progreso).outerjoin(
+            progreso, progreso.c.plan_id == PaymentPlan.id
+        ).order_by(PaymentPlan.id.desc()).options(
             db.joinedload(PaymentPlan.student),
             db.joinedload(PaymentPlan.concept)
-        ).all()
+        )
         
-        result = []
-        for plan in plans:
-            paid_installments = PaymentInstallment.query.filter_by(
-                plan_id=plan.id, 
-                status='paid'
-            ).count()
+        try:
+            if request.args.get('plan_id'):
+                query = query.filter(PaymentPlan.id == int(request.args['plan_id']))
+            if request.args.get('student_id'):
+                query = query.filter(PaymentPlan.student_id == int(request.args['student_id']))
+            if request.args.get('concept_id'):
+                query = query.filter(PaymentPlan.concept_id == int(request.args['concept_id']))
+            if request.args.get('status'):
+                query = query.filter(PaymentPlan.status == request.args['status'])
             
-            result.append({
-                'id': plan.id,
-                'student_name': f"{plan.student.first_name} {plan.student.last_name}",
-                'student_dni': plan.student.dni,
-                'concept_name': plan.concept.name,
-                'total_amount': plan.total_amount,
-                'installments': plan.installments,
-                'paid_installments': paid_installments,
-                'start_date': plan.start_date,
-                'status': plan.status,
-                'created_date': plan.created_date
-            })
+            paginated = 'limit' in request.args or 'cursor' in request.args
+            if paginated:
+                limit = min(max(int(request.args.get('limit', PLANS_PAGE_SIZE)), 1), PLANS_MAX_PAGE_SIZE)
+                cursor = decode_cursor(request.args.get('cursor'), size=1)
+                if cursor:
+                    query = query.filter(PaymentPlan.id < int(cursor[0]))
+                query = query.limit(limit + 1)
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'error': 'Parámetros de búsqueda inválidos'}), 400
         
-        return jsonify(result)
+        rows = query.all()
+        
+        next_cursor = None
+        if paginated and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][0].id])
+        
+        result = PAYMENT_PLAN_SERIALIZER.many(rows)
+        
+        if not paginated:
+            return jsonify(result)
+        
+        return jsonify({
+            'success': True,
+            'data': result,
+            'next_cursor': next_cursor
+        })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # OBTENER CUOTAS DE UN PLAN
 @app.route('/api/payment-plans/<int:plan_id>/installments')
+@query_budget(1)
 def get_plan_installments(plan_id):
     try:
+        # La cuota de mora comparte número con su cuota y se lista justo después
         installments = PaymentInstallment.query.filter_by(plan_id=plan_id).order_by(
-            PaymentInstallment.installment_number
+            PaymentInstallment.installment_number, PaymentInstallment.id
         ).all()
         
-        result = []
-        for installment in installments:
-            result.append({
-                'id': installment.id,
-                'installment_number': installment.installment_number,
-                'due_date': installment.due_date,
-                'amount': installment.amount,
-                'status': installment.status,
-                'payment_date': installment.payment_date,
-                'payment_id': installment.payment_id
-            })
+        return jsonify(INSTALLMENT_SERIALIZER.many(installments))
         
-        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# CUOTAS POR RANGO DE VENCIMIENTO
+@app.route('/api/installments')
+@query_budget(1)
+def installments_by_due_date():
+    """Cuotas que vencen entre from_date y to_date (ambas incluidas)"""
+    try:
+        try:
+            from_date = parse_date(request.args.get('from_date'))
+            to_date = parse_date(request.args.get('to_date'))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Formato de fecha inválido (YYYY-MM-DD)'}), 400
+        
+        if not from_date or not to_date:
+            return jsonify({'success': False, 'error': 'Debe indicar from_date y to_date'}), 400
+        
+        # Rango sobre el índice de due_date
+        query = PaymentInstallment.query.options(
+            db.joinedload(PaymentInstallment.plan).joinedload(PaymentPlan.student),
+            db.joinedload(PaymentInstallment.plan).joinedload(PaymentPlan.concept)
+        ).filter(
+            PaymentInstallment.due_date >= from_date,
+            PaymentInstallment.due_date <= to_date
+        )
+        
+        if request.args.get('status'):
+            query = query.filter(PaymentInstallment.status == request.args['status'])
+        
+        installments = query.order_by(PaymentInstallment.due_date, PaymentInstallment.id).all()
+        
+        return jsonify({'success': True, 'data': INSTALLMENT_DUE_SERIALIZER.many(installments)})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ANTIGÜEDAD DE LA DEUDA (TRAMOS DEL BARRIDO DE CUOTAS VENCIDAS)
+@app.route('/api/installments/aging')
+@query_budget(2)
+@cached_response('payment_installment')
+def installments_aging():
+    try:
+        rows = db.session.query(
+            PaymentInstallment.aging_bucket,
+            db.func.count(PaymentInstallment.id),
+            db.func.sum(PaymentInstallment.amount)
+        ).filter(
+            PaymentInstallment.status == 'overdue'
+        ).group_by(PaymentInstallment.aging_bucket).all()
+        
+        totals = {bucket: (count, amount) for bucket, count, amount in rows}
+        labels = [label for _, label in AGING_BUCKETS] + [AGING_BUCKET_OVER]
+        return jsonify({'success': True, 'data': [{
+            'tramo': label,
+            'cuotas': totals.get(label, (0, 0))[0],
+            'monto': round(totals.get(label, (0, 0))[1] or 0, 2)
+        } for label in labels]})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1141,15 +2483,14 @@ def pay_installment(installment_id):
             return jsonify({'success': False, 'error': 'Esta cuota ya está pagada'}), 400
         
         # Generar número de recibo
-        import random
-        receipt_number = f"R-{datetime.now().strftime('%Y%m%d')}-{random.randint(1000, 9999)}"
+        receipt_number = next_receipt_number()
         
         # Crear pago en el sistema existente
         payment = Payment(
             student_id=installment.plan.student_id,
             concept_id=installment.plan.concept_id,
             amount=installment.amount,
-            payment_date=data['payment_date'],
+            payment_date=parse_date(data['payment_date']),
             due_date=installment.due_date,
             receipt_number=receipt_number
         )
@@ -1159,9 +2500,19 @@ def pay_installment(installment_id):
         
         # Actualizar cuota
         installment.status = 'paid'
-        installment.payment_date = data['payment_date']
+        installment.payment_date = payment.payment_date
         installment.payment_id = payment.id
         
+        post_account_entries([{
+            'student_id': payment.student_id,
+            'kind': 'pago',
+            'amount': payment.amount,
+            'entry_date': payment.payment_date,
+            'concept_id': payment.concept_id,
+            'plan_id': installment.plan_id,
+            'payment_id': payment.id
+        }])
+        
         db.session.commit()
         
         return jsonify({
@@ -1177,6 +2528,7 @@ def pay_installment(installment_id):
 
 # OBTENER DETALLES DE CUOTA
 @app.route('/api/installments/<int:installment_id>')
+@query_budget(1)
 def get_installment_details(installment_id):
     try:
         installment = PaymentInstallment.query.options(
@@ -1190,18 +2542,80 @@ def get_installment_details(installment_id):
         
         return jsonify({
             'success': True,
-            'installment': {
-                'id': installment.id,
-                'installment_number': installment.installment_number,
-                'due_date': installment.due_date,
-                'amount': installment.amount,
-                'status': installment.status,
-                'payment_date': installment.payment_date,
-                'student_name': f"{installment.plan.student.first_name} {installment.plan.student.last_name}",
-                'student_dni': installment.plan.student.dni,
-                'concept_name': installment.plan.concept.name,
-                'payment_id': installment.payment_id
-            }
+            'installment': INSTALLMENT_DETAIL_SERIALIZER(installment)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# CUENTA CORRIENTE DEL ESTUDIANTE
+@app.route('/api/students/<int:student_id>/account')
+@query_budget(3)
+def student_account(student_id):
+    """Saldo (una fila de StudentAccount) y últimos movimientos del estudiante"""
+    try:
+        limit = min(max(int(request.args.get('limit', ACCOUNT_ENTRIES_PAGE_SIZE)), 1), ACCOUNT_ENTRIES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Parámetros de búsqueda inválidos'}), 400
+    
+    try:
+        account = db.session.get(StudentAccount, student_id)
+        if account is None:
+            # Sin movimientos todavía: saldo cero si el estudiante existe
+            if not db.session.query(Student.query.filter_by(id=student_id).exists()).scalar():
+                return jsonify({'success': False, 'error': 'Estudiante no encontrado'}), 404
+            account = StudentAccount(student_id=student_id, charged=0, paid=0, balance=0)
+        
+        entries = AccountEntry.query.options(db.joinedload(AccountEntry.concept)).filter_by(
+            student_id=student_id
+        ).order_by(AccountEntry.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'success': True,
+            'account': STUDENT_ACCOUNT_SERIALIZER(account),
+            'entries': ACCOUNT_ENTRY_SERIALIZER.many(entries)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# MOROSOS: ESTUDIANTES CON SALDO PENDIENTE, DEL MAYOR AL MENOR
+@app.route('/api/students/debtors')
+@query_budget(1)
+def student_debtors():
+    try:
+        limit = min(max(int(request.args.get('limit', DEBTORS_PAGE_SIZE)), 1), DEBTORS_MAX_PAGE_SIZE)
+        cursor = decode_cursor(request.args.get('cursor'))
+        min_balance = float(request.args.get('min_balance', ACCOUNT_DEBT_EPSILON))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'Parámetros de búsqueda inválidos'}), 400
+    
+    try:
+        # Recorre el índice (balance, student_id) de mayor a menor
+        query = StudentAccount.query.options(
+            db.joinedload(StudentAccount.student).load_only(Student.first_name, Student.last_name, Student.dni)
+        ).filter(StudentAccount.balance >= min_balance)
+        
+        if cursor:
+            balance, student_id = float(cursor[0]), int(cursor[1])
+            query = query.filter(db.or_(
+                StudentAccount.balance < balance,
+                db.and_(StudentAccount.balance == balance, StudentAccount.student_id < student_id)
+            ))
+        
+        accounts = query.order_by(
+            StudentAccount.balance.desc(), StudentAccount.student_id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(accounts) > limit:
+            accounts = accounts[:limit]
+            next_cursor = encode_cursor([accounts[-1].balance, accounts[-1].student_id])
+        
+        return jsonify({
+            'success': True,
+            'data': DEBTOR_SERIALIZER.many(accounts),
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
@@ -1209,28 +2623,18 @@ def get_installment_details(installment_id):
 
 # APIS PARA ALMACÉN - AGREGAR ANTES DE calculate_age
 @app.route('/api/almacen/utiles', methods=['GET', 'POST'])
+@query_budget(1)
 def utiles_escolares():
     try:
         if request.method == 'GET':
             aula_id = request.args.get('aula_id')
+            query = AlmacenUtil.query.options(db.joinedload(AlmacenUtil.aula))
             if aula_id:
-                utiles = AlmacenUtil.query.filter_by(aula_id=aula_id).all()
+                utiles = query.filter_by(aula_id=aula_id).all()
             else:
-                utiles = AlmacenUtil.query.all()
+                utiles = query.all()
             
-            result = []
-            for util in utiles:
-                result.append({
-                    'id': util.id,
-                    'aula_id': util.aula_id,
-                    'material': util.material,
-                    'cantidad_requerida': util.cantidad_requerida,
-                    'especificaciones': util.especificaciones,
-                    'created_at': util.created_at,
-                    'aula_nombre': util.aula.name if util.aula else ''
-                })
-            
-            return jsonify(result)
+            return jsonify(UTIL_SERIALIZER.many(utiles))
         
         elif request.method == 'POST':
             data = request.get_json()
@@ -1288,7 +2692,7 @@ def registrar_entrega():
             estudiante_id=data['estudiante_id'],
             util_id=data['util_id'],
             cantidad_entregada=data['cantidad_entregada'],
-            fecha_entrega=data.get('fecha_entrega', datetime.now().strftime('%Y-%m-%d')),
+            fecha_entrega=parse_date(data.get('fecha_entrega')) or date.today(),
             observaciones=data.get('observaciones', '')
         )
         
@@ -1302,6 +2706,7 @@ def registrar_entrega():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/almacen/entregas/<int:aula_id>')
+@query_budget(3)
 def obtener_entregas_aula(aula_id):
     try:
         # Obtener estudiantes del aula
@@ -1319,25 +2724,9 @@ def obtener_entregas_aula(aula_id):
         ).all()
         
         result = {
-            'estudiantes': [{
-                'id': e.id,
-                'nombre': f"{e.first_name} {e.last_name}",
-                'dni': e.dni
-            } for e in estudiantes],
-            'utiles': [{
-                'id': u.id,
-                'material': u.material,
-                'cantidad_requerida': u.cantidad_requerida,
-                'especificaciones': u.especificaciones
-            } for u in utiles],
-            'entregas': [{
-                'id': e.id,
-                'estudiante_id': e.estudiante_id,
-                'util_id': e.util_id,
-                'cantidad_entregada': e.cantidad_entregada,
-                'fecha_entrega': e.fecha_entrega,
-                'observaciones': e.observaciones
-            } for e in entregas]
+            'estudiantes': ESTUDIANTE_AULA_SERIALIZER.many(estudiantes),
+            'utiles': UTIL_AULA_SERIALIZER.many(utiles),
+            'entregas': ENTREGA_SERIALIZER.many(entregas)
         }
         
         return jsonify(result)
@@ -1346,88 +2735,120 @@ def obtener_entregas_aula(aula_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # REPORTES - AGREGAR DESPUÉS DE LAS ÚLTIMAS APIS EXISTENTES
+# Cada reporte se genera fila por fila (yield_per); el JSON las junta en una lista
+# y ?format=csv|xlsx las envía en streaming sin cargarlas todas en memoria.
+
+ESTUDIANTES_POR_AULA_COLUMNS = [
+    ('id', 'ID'), ('nombre_completo', 'Estudiante'), ('dni', 'DNI'), ('edad', 'Edad'),
+    ('telefono', 'Teléfono'), ('aula', 'Aula')
+]
+
+def iter_estudiantes_por_aula(aula_id=None):
+    query = db.session.query(
+        Student.id, Student.first_name, Student.last_name, Student.dni,
+        Student.birth_date, Student.phone, Classroom.name, Enrollment.classroom_id
+    ).join(
+        Enrollment, Enrollment.student_id == Student.id
+    ).join(
+        Classroom, Classroom.id == Enrollment.classroom_id
+    ).filter(
+        Enrollment.status == 'active'
+    )
+    
+    if aula_id:
+        query = query.filter(Enrollment.classroom_id == aula_id)
+    
+    query = query.order_by(Enrollment.classroom_id, Student.last_name, Student.first_name)
+    
+    for row in query.yield_per(REPORT_BATCH_SIZE):
+        yield {
+            'id': row.id,
+            'nombre_completo': f"{row.first_name} {row.last_name}",
+            'dni': row.dni,
+            'edad': calculate_age(row.birth_date),
+            'telefono': row.phone,
+            'aula': row.name,
+            'aula_id': row.classroom_id
+        }
 
 @app.route('/api/reportes/estudiantes-por-aula')
+@background_job
+@query_budget(2)
+@cached_response('student', 'enrollment', 'classroom')
 def reporte_estudiantes_por_aula():
     """Reporte 1: Lista de estudiantes por aula"""
     try:
-        aula_id = request.args.get('aula_id')
-        
-        query = Student.query.join(Enrollment).join(Classroom).filter(
-            Enrollment.status == 'active'
-        )
-        
-        if aula_id:
-            query = query.filter(Enrollment.classroom_id == aula_id)
+        rows = iter_estudiantes_por_aula(request.args.get('aula_id'))
         
-        estudiantes = query.all()
+        if request.args.get('format'):
+            return export_report(rows, ESTUDIANTES_POR_AULA_COLUMNS, 'estudiantes_por_aula')
         
-        result = []
-        for estudiante in estudiantes:
-            # Encontrar la matrícula activa
-            matricula = next((e for e in estudiante.enrollments if e.status == 'active'), None)
-            if matricula:
-                result.append({
-                    'id': estudiante.id,
-                    'nombre_completo': f"{estudiante.first_name} {estudiante.last_name}",
-                    'dni': estudiante.dni,
-                    'edad': calculate_age(estudiante.birth_date),
-                    'telefono': estudiante.phone,
-                    'aula': matricula.classroom.name,
-                    'aula_id': matricula.classroom_id
-                })
-        
-        return jsonify({'success': True, 'data': result})
+        return jsonify({'success': True, 'data': list(rows)})
         
     except Exception as e:
         print("Error en reporte estudiantes:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+CUOTAS_VENCIDAS_COLUMNS = [
+    ('alumno_nombre', 'Estudiante'), ('alumno_dni', 'DNI'), ('aula', 'Aula'), ('concepto', 'Concepto'),
+    ('cuota_numero', 'N° cuota'), ('monto', 'Monto'), ('fecha_vencimiento', 'Vencimiento'),
+    ('dias_mora', 'Días de mora'), ('tramo', 'Tramo')
+]
+
+def iter_cuotas_vencidas():
+    hoy = date.today()
+    
+    # Cuotas marcadas como vencidas por el barrido, con alumno, concepto y aula de la matrícula activa
+    query = db.session.query(
+        PaymentInstallment.installment_number, PaymentInstallment.amount, PaymentInstallment.due_date,
+        PaymentInstallment.aging_bucket, PaymentInstallment.late_fee_for_id, Student.id.label('alumno_id'), Student.first_name, Student.last_name, Student.dni,
+        PaymentConcept.name.label('concepto'), Classroom.name.label('aula')
+    ).join(
+        PaymentPlan, PaymentPlan.id == PaymentInstallment.plan_id
+    ).join(
+        Student, Student.id == PaymentPlan.student_id
+    ).join(
+        PaymentConcept, PaymentConcept.id == PaymentPlan.concept_id
+    ).outerjoin(
+        Enrollment, db.and_(Enrollment.student_id == Student.id, Enrollment.status == 'active')
+    ).outerjoin(
+        Classroom, Classroom.id == Enrollment.classroom_id
+    ).filter(
+        PaymentInstallment.status == 'overdue'
+    ).order_by(PaymentInstallment.due_date, PaymentInstallment.id)
+    
+    for row in query.yield_per(REPORT_BATCH_SIZE):
+        yield {
+            'alumno_id': row.alumno_id,
+            'alumno_nombre': f"{row.first_name} {row.last_name}",
+            'alumno_dni': row.dni,
+            'aula': row.aula or 'Sin aula',
+            'concepto': f"{row.concepto} (mora)" if row.late_fee_for_id else row.concepto,
+            'cuota_numero': row.installment_number,
+            'monto': row.amount,
+            'fecha_vencimiento': format_date(row.due_date),
+            'dias_mora': (hoy - row.due_date).days,
+            'tramo': row.aging_bucket
+        }
+
 @app.route('/api/reportes/cuotas-vencidas')
+@background_job
+@query_budget(2)
+@cached_response('payment_installment', 'payment_plan', 'payment_concept', 'student', 'enrollment', 'classroom')
 def reporte_cuotas_vencidas():
     """Reporte 2: Cuotas vencidas por alumno"""
     try:
-        from datetime import datetime
-        
-        hoy = datetime.now().date()
-        
-        # Obtener cuotas vencidas
-        cuotas_vencidas = PaymentInstallment.query.join(
-            PaymentPlan
-        ).join(
-            Student
-        ).join(
-            Enrollment
-        ).join(
-            Classroom
-        ).filter(
-            PaymentInstallment.status == 'pending',
-            PaymentInstallment.due_date < hoy.strftime('%Y-%m-%d')
-        ).all()
+        rows = iter_cuotas_vencidas()
         
-        result = []
-        total_adeudado = 0
+        if request.args.get('format'):
+            return export_report(rows, CUOTAS_VENCIDAS_COLUMNS, 'cuotas_vencidas')
         
-        for cuota in cuotas_vencidas:
-            dias_mora = (hoy - datetime.strptime(cuota.due_date, '%Y-%m-%d').date()).days
-            
-            result.append({
-                'alumno_id': cuota.plan.student.id,
-                'alumno_nombre': f"{cuota.plan.student.first_name} {cuota.plan.student.last_name}",
-                'alumno_dni': cuota.plan.student.dni,
-                'aula': cuota.plan.student.enrollments[0].classroom.name if cuota.plan.student.enrollments else 'Sin aula',
-                'concepto': cuota.plan.concept.name,
-                'cuota_numero': cuota.installment_number,
-                'monto': cuota.amount,
-                'fecha_vencimiento': cuota.due_date,
-                'dias_mora': dias_mora
-            })
-            total_adeudado += cuota.amount
+        result = list(rows)
         
         return jsonify({
             'success': True, 
             'data': result,
-            'total_adeudado': total_adeudado,
+            'total_adeudado': sum(cuota['monto'] for cuota in result),
             'total_cuotas': len(result)
         })
         
@@ -1435,69 +2856,88 @@ def reporte_cuotas_vencidas():
         print("Error en reporte cuotas vencidas:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+STOCK_BAJO_COLUMNS = [
+    ('nombre', 'Material'), ('categoria', 'Categoría'), ('stock_actual', 'Stock actual'),
+    ('stock_minimo', 'Stock mínimo'), ('unidad_medida', 'Unidad'), ('diferencia', 'Faltante'),
+    ('estado', 'Estado'), ('ubicacion', 'Ubicación')
+]
+
+def iter_stock_bajo():
+    query = MaterialAula.query.filter(
+        MaterialAula.stock_actual <= MaterialAula.stock_minimo
+    ).order_by(MaterialAula.id)
+    
+    for material in query.yield_per(REPORT_BATCH_SIZE):
+        yield {
+            'id': material.id,
+            'nombre': material.nombre,
+            'categoria': material.categoria,
+            'stock_actual': material.stock_actual,
+            'stock_minimo': material.stock_minimo,
+            'unidad_medida': material.unidad_medida,
+            'diferencia': material.stock_minimo - material.stock_actual,
+            'estado': 'CRÍTICO' if material.stock_actual == 0 else 'BAJO',
+            'ubicacion': material.ubicacion or 'No especificada'
+        }
+
 @app.route('/api/reportes/stock-bajo')
+@background_job
+@query_budget(2)
+@cached_response('material_aula')
 def reporte_stock_bajo():
     """Reporte 3: Materiales con stock bajo"""
     try:
-        materiales = MaterialAula.query.filter(
-            MaterialAula.stock_actual <= MaterialAula.stock_minimo
-        ).all()
+        rows = iter_stock_bajo()
         
-        result = []
-        for material in materiales:
-            estado = 'CRÍTICO' if material.stock_actual == 0 else 'BAJO'
-            result.append({
-                'id': material.id,
-                'nombre': material.nombre,
-                'categoria': material.categoria,
-                'stock_actual': material.stock_actual,
-                'stock_minimo': material.stock_minimo,
-                'unidad_medida': material.unidad_medida,
-                'diferencia': material.stock_minimo - material.stock_actual,
-                'estado': estado,
-                'ubicacion': material.ubicacion or 'No especificada'
-            })
+        if request.args.get('format'):
+            return export_report(rows, STOCK_BAJO_COLUMNS, 'stock_bajo')
         
-        return jsonify({'success': True, 'data': result})
+        return jsonify({'success': True, 'data': list(rows)})
         
     except Exception as e:
         print("Error en reporte stock bajo:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+RESUMEN_MATRICULAS_COLUMNS = [
+    ('aula_nombre', 'Aula'), ('edad_rango', 'Edades'), ('capacidad', 'Capacidad'),
+    ('matriculados', 'Matriculados'), ('cupos_disponibles', 'Cupos disponibles'),
+    ('porcentaje_ocupacion', '% ocupación')
+]
+
+def iter_resumen_matriculas():
+    for aula in Classroom.query.order_by(Classroom.id).yield_per(REPORT_BATCH_SIZE):
+        matriculados = aula.current_students or 0
+        yield {
+            'aula_id': aula.id,
+            'aula_nombre': aula.name,
+            'edad_rango': aula.age_range,
+            'capacidad': aula.capacity,
+            'matriculados': matriculados,
+            'cupos_disponibles': aula.capacity - matriculados,
+            'porcentaje_ocupacion': round((matriculados / aula.capacity) * 100, 1) if aula.capacity > 0 else 0
+        }
+
 @app.route('/api/reportes/resumen-matriculas')
+@background_job
+@query_budget(2)
+@cached_response('classroom')
 def reporte_resumen_matriculas():
     """Reporte 4: Resumen de matrículas por aula"""
     try:
-        aulas = Classroom.query.all()
+        rows = iter_resumen_matriculas()
         
-        result = []
-        total_matriculados = 0
-        total_capacidad = 0
+        if request.args.get('format'):
+            return export_report(rows, RESUMEN_MATRICULAS_COLUMNS, 'resumen_matriculas')
         
-        for aula in aulas:
-            matriculados = Enrollment.query.filter_by(
-                classroom_id=aula.id, 
-                status='active'
-            ).count()
-            
-            result.append({
-                'aula_id': aula.id,
-                'aula_nombre': aula.name,
-                'edad_rango': aula.age_range,
-                'capacidad': aula.capacity,
-                'matriculados': matriculados,
-                'cupos_disponibles': aula.capacity - matriculados,
-                'porcentaje_ocupacion': round((matriculados / aula.capacity) * 100, 1) if aula.capacity > 0 else 0
-            })
-            
-            total_matriculados += matriculados
-            total_capacidad += aula.capacity
+        result = list(rows)
+        total_matriculados = sum(aula['matriculados'] for aula in result)
+        total_capacidad = sum(aula['capacidad'] for aula in result)
         
         return jsonify({
             'success': True, 
             'data': result,
             'totales': {
-                'total_aulas': len(aulas),
+                'total_aulas': len(result),
                 'total_matriculados': total_matriculados,
                 'total_capacidad': total_capacidad,
                 'porcentaje_total': round((total_matriculados / total_capacidad) * 100, 1) if total_capacidad > 0 else 0
@@ -1508,65 +2948,96 @@ def reporte_resumen_matriculas():
         print("Error en reporte resumen matrículas:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+UTILES_PENDIENTES_COLUMNS = [
+    ('aula_nombre', 'Aula'), ('material', 'Material'), ('cantidad_requerida', 'Cantidad requerida'),
+    ('total_pendiente', 'Total pendiente'), ('estudiantes_con_faltantes', 'Estudiantes con faltantes'),
+    ('especificaciones', 'Especificaciones')
+]
+
+def iter_utiles_pendientes(aula_id=None):
+    # Total entregado por (estudiante, útil)
+    entregas = db.session.query(
+        AlmacenEntrega.estudiante_id.label('estudiante_id'),
+        AlmacenEntrega.util_id.label('util_id'),
+        db.func.sum(AlmacenEntrega.cantidad_entregada).label('entregado')
+    ).group_by(AlmacenEntrega.estudiante_id, AlmacenEntrega.util_id).subquery()
+    
+    pendiente = AlmacenUtil.cantidad_requerida - db.func.coalesce(entregas.c.entregado, 0)
+    total_pendiente = db.func.sum(db.case((pendiente > 0, pendiente), else_=0))
+    estudiantes_con_faltantes = db.func.sum(db.case((pendiente > 0, 1), else_=0))
+    
+    # Una sola consulta: útil x estudiante matriculado en el aula, agrupado por útil
+    query = db.session.query(
+        Classroom.id,
+        Classroom.name,
+        AlmacenUtil.material,
+        AlmacenUtil.cantidad_requerida,
+        AlmacenUtil.especificaciones,
+        total_pendiente.label('total_pendiente'),
+        estudiantes_con_faltantes.label('estudiantes_con_faltantes')
+    ).join(
+        Classroom, Classroom.id == AlmacenUtil.aula_id
+    ).join(
+        Enrollment, db.and_(
+            Enrollment.classroom_id == AlmacenUtil.aula_id,
+            Enrollment.status == 'active'
+        )
+    ).outerjoin(
+        entregas, db.and_(
+            entregas.c.estudiante_id == Enrollment.student_id,
+            entregas.c.util_id == AlmacenUtil.id
+        )
+    )
+    
+    if aula_id:
+        query = query.filter(AlmacenUtil.aula_id == aula_id)
+    
+    query = query.group_by(
+        Classroom.id, Classroom.name, AlmacenUtil.id, AlmacenUtil.material,
+        AlmacenUtil.cantidad_requerida, AlmacenUtil.especificaciones
+    ).having(
+        total_pendiente > 0
+    ).order_by(Classroom.id, AlmacenUtil.id)
+    
+    for fila in query.yield_per(REPORT_BATCH_SIZE):
+        yield {
+            'aula_id': fila.id,
+            'aula_nombre': fila.name,
+            'material': fila.material,
+            'cantidad_requerida': fila.cantidad_requerida,
+            'total_pendiente': int(fila.total_pendiente),
+            'estudiantes_con_faltantes': int(fila.estudiantes_con_faltantes),
+            'especificaciones': fila.especificaciones or 'No especificado'
+        }
+
 @app.route('/api/reportes/utiles-pendientes')
+@background_job
+@query_budget(2)
+@cached_response('almacen_util', 'almacen_entrega', 'enrollment', 'classroom')
 def reporte_utiles_pendientes():
     """Reporte 5: Útiles pendientes por aula"""
     try:
-        aula_id = request.args.get('aula_id')
+        rows = iter_utiles_pendientes(request.args.get('aula_id'))
         
-        # Obtener aulas
-        query = Classroom.query
-        if aula_id:
-            query = query.filter(Classroom.id == aula_id)
-        aulas = query.all()
+        if request.args.get('format'):
+            return export_report(rows, UTILES_PENDIENTES_COLUMNS, 'utiles_pendientes')
         
+        # Agrupar por aula; solo aparecen aulas con útiles pendientes
         result = []
-        
-        for aula in aulas:
-            # Obtener útiles configurados para el aula
-            utiles = AlmacenUtil.query.filter_by(aula_id=aula.id).all()
-            
-            aula_data = {
-                'aula_id': aula.id,
-                'aula_nombre': aula.name,
-                'utiles': []
-            }
-            
-            for util in utiles:
-                # Obtener estudiantes del aula
-                estudiantes = Student.query.join(Enrollment).filter(
-                    Enrollment.classroom_id == aula.id,
-                    Enrollment.status == 'active'
-                ).all()
-                
-                total_pendiente = 0
-                estudiantes_con_faltantes = 0
-                
-                for estudiante in estudiantes:
-                    # Obtener entregas de este útil
-                    entregas = AlmacenEntrega.query.filter_by(
-                        estudiante_id=estudiante.id,
-                        util_id=util.id
-                    ).all()
-                    
-                    total_entregado = sum(e.cantidad_entregada for e in entregas)
-                    pendiente = util.cantidad_requerida - total_entregado
-                    
-                    if pendiente > 0:
-                        total_pendiente += pendiente
-                        estudiantes_con_faltantes += 1
-                
-                if total_pendiente > 0:
-                    aula_data['utiles'].append({
-                        'material': util.material,
-                        'cantidad_requerida': util.cantidad_requerida,
-                        'total_pendiente': total_pendiente,
-                        'estudiantes_con_faltantes': estudiantes_con_faltantes,
-                        'especificaciones': util.especificaciones or 'No especificado'
-                    })
-            
-            if aula_data['utiles']:  # Solo agregar aulas con útiles pendientes
-                result.append(aula_data)
+        for fila in rows:
+            if not result or result[-1]['aula_id'] != fila['aula_id']:
+                result.append({
+                    'aula_id': fila['aula_id'],
+                    'aula_nombre': fila['aula_nombre'],
+                    'utiles': []
+                })
+            result[-1]['utiles'].append({
+                'material': fila['material'],
+                'cantidad_requerida': fila['cantidad_requerida'],
+                'total_pendiente': fila['total_pendiente'],
+                'estudiantes_con_faltantes': fila['estudiantes_con_faltantes'],
+                'especificaciones': fila['especificaciones']
+            })
         
         return jsonify({'success': True, 'data': result})
         
@@ -1574,17 +3045,1134 @@ def reporte_utiles_pendientes():
         print("Error en reporte útiles pendientes:", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# === BÚSQUEDA DE ESTUDIANTES (FTS5 / pg_trgm / ÍNDICE EN MEMORIA) ===
+# Student.search_text guarda nombres y DNI sin tildes ni mayúsculas. En SQLite lo
+# indexa la tabla FTS5 student_fts (trigramas, sincronizada por triggers), en
+# PostgreSQL un índice GIN de pg_trgm y, si ninguno está disponible, un índice de
+# trigramas en memoria que se reconstruye cuando cambia la versión de 'student'.
+SEARCH_FIELDS = ['first_name', 'last_name', 'dni', 'father_names', 'father_dni', 'mother_names', 'mother_dni']
+SEARCH_MIN_SIMILARITY = 0.5
+SEARCH_CANDIDATES = 200
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_BACKFILL_BATCH = 1000
+
+def normalize_search_text(value):
+    """Minúsculas, sin tildes y con espacios simples ('Nuñez' -> 'nunez')"""
+    decomposed = unicodedata.normalize('NFKD', str(value or ''))
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^\w]+', ' ', stripped.lower()).split())
+
+def student_search_text(student):
+    get = student.get if isinstance(student, dict) else lambda field: getattr(student, field, None)
+    return ' '.join(filter(None, (normalize_search_text(get(field)) for field in SEARCH_FIELDS)))
+
+def search_trigrams(text):
+    """Trigramas de cada palabra con relleno, como pg_trgm"""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def search_similarity(query, query_grams, text):
+    """Fracción de los trigramas de la consulta presentes en el texto (similar a word_similarity)"""
+    if not query_grams:
+        return 0.0
+    # Con dos espacios entre palabras cada trigrama con relleno aparece como subcadena
+    padded = '  ' + '  '.join(text.split()) + ' '
+    score = sum(1 for gram in query_grams if gram in padded) / len(query_grams)
+    # Una coincidencia literal (prefijo de nombre o DNI parcial) va siempre primero
+    if query in text:
+        score += 1.0
+    return score
+
+@event.listens_for(Student, 'before_insert')
+def set_search_text_on_insert(mapper, connection, target):
+    target.search_text = student_search_text(target)
+
+@event.listens_for(Student, 'before_update')
+def set_search_text_on_update(mapper, connection, target):
+    state = db.inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in SEARCH_FIELDS):
+        target.search_text = student_search_text(target)
+
+class Fts5SearchBackend:
+    name = 'fts5'
+    
+    def candidates(self, query, wanted):
+        # Sin ORDER BY bm25: ordenar todas las coincidencias de un trigrama común es lo
+        # que cuesta; el puntaje final se calcula en Python sobre los candidatos
+        words = [w for w in query.split() if len(w) >= 3]
+        if not words:
+            return LikeSearchBackend().candidates(query, wanted)
+        
+        # 1) Coincidencia literal de cada palabra (una frase con el tokenizador trigram es una subcadena)
+        rows = self.match(' AND '.join(fts_phrase(w) for w in words), SEARCH_CANDIDATES)
+        if len(rows) >= wanted:
+            return rows
+        
+        # 2) Aproximada: basta un fragmento de 4 letras de alguna palabra (tolera una errata)
+        fragments = {w[i:i + 4] for w in words for i in range(max(len(w) - 3, 1))}
+        seen = {row[0] for row in rows}
+        fuzzy = self.match(' OR '.join(fts_phrase(f) for f in sorted(fragments)), SEARCH_CANDIDATES * 2)
+        return rows + [row for row in fuzzy if row[0] not in seen]
+    
+    def match(self, expression, limit):
+        return db.session.execute(db.text(
+            "SELECT s.id, s.search_text FROM student_fts "
+            "JOIN student s ON s.id = student_fts.rowid "
+            "WHERE student_fts MATCH :match LIMIT :limit"
+        ), {'match': expression, 'limit': limit}).all()
+
+def fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+class PgTrigramSearchBackend:
+    name = 'pg_trgm'
+    
+    def candidates(self, query, wanted):
+        return db.session.execute(db.text(
+            "SELECT id, search_text FROM student "
+            "WHERE :query <% search_text OR search_text LIKE :pattern "
+            "ORDER BY word_similarity(:query, search_text) DESC LIMIT :limit"
+        ), {'query': query, 'pattern': f'%{escape_like(query)}%', 'limit': SEARCH_CANDIDATES}).all()
+
+class LikeSearchBackend:
+    """Consultas sin palabras de tres letras: no forman trigramas completos"""
+    name = 'like'
+    
+    def candidates(self, query, wanted):
+        return db.session.execute(
+            db.select(Student.id, Student.search_text)
+            .where(Student.search_text.like(f'%{escape_like(query)}%', escape='\\'))
+            .limit(SEARCH_CANDIDATES)
+        ).all()
+
+class MemorySearchBackend:
+    name = 'memory'
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.texts = {}
+        self.postings = {}
+    
+    def refresh(self):
+        # Se reconstruye si otro proceso (o este) modificó estudiantes desde la última carga
+        version = get_table_versions(['student'])
+        if version == self.version and None not in version:
+            return
+        texts = dict(db.session.execute(db.select(Student.id, Student.search_text)).all())
+        postings = {}
+        for student_id, text in texts.items():
+            for gram in search_trigrams(text or ''):
+                postings.setdefault(gram, set()).add(student_id)
+        with self.lock:
+            self.texts, self.postings, self.version = texts, postings, version
+    
+    def candidates(self, query, wanted):
+        self.refresh()
+        hits = Counter()
+        for gram in search_trigrams(query):
+            hits.update(self.postings.get(gram, ()))
+        return [(student_id, self.texts[student_id]) for student_id, _ in hits.most_common(SEARCH_CANDIDATES)]
+
+search_backends = {}
+
+def get_search_backend():
+    """Backend de búsqueda según el motor y las extensiones disponibles (se detecta una vez)"""
+    engine = db.engine
+    if engine not in search_backends:
+        # La detección corre una vez por proceso: no cuenta en el presupuesto de la primera búsqueda
+        with engine.connect().execution_options(count_query=False) as conn:
+            if engine.dialect.name == 'sqlite' and db.inspect(conn).has_table('student_fts'):
+                search_backends[engine] = Fts5SearchBackend()
+            elif engine.dialect.name == 'postgresql' and conn.execute(
+                db.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).first():
+                search_backends[engine] = PgTrigramSearchBackend()
+            else:
+                search_backends[engine] = MemorySearchBackend()
+    return search_backends[engine]
+
+def search_students(q, limit):
+    """Ids de estudiantes ordenados por similitud con `q`, con su puntaje"""
+    query = normalize_search_text(q)
+    if not query:
+        return []
+    backend = get_search_backend()
+    query_grams = search_trigrams(query)
+    fragments = {w[i:i + 4] for w in query.split() for i in range(max(len(w) - 3, 1))}
+    scored = []
+    for student_id, text in backend.candidates(query, limit):
+        text = text or ''
+        score = search_similarity(query, query_grams, text)
+        if score >= SEARCH_MIN_SIMILARITY:
+            # A igual puntaje gana la coincidencia más a la izquierda (el alumno antes que los padres)
+            position = text.find(query)
+            if position < 0:
+                position = min((text.find(f) for f in fragments if f in text), default=len(text))
+            scored.append((-score, position, student_id))
+    scored.sort()
+    return [(student_id, -score) for score, _, student_id in scored[:limit]]
+
+def create_search_index():
+    """Índice de búsqueda según el motor; sin FTS5 ni pg_trgm se usa el índice en memoria"""
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'sqlite':
+                conn.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS student_fts USING fts5("
+                    "search_text, content='student', content_rowid='id', tokenize='trigram')"
+                )
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS student_fts_ai AFTER INSERT ON student BEGIN "
+                    "INSERT INTO student_fts(rowid, search_text) VALUES (new.id, new.search_text); END"
+                )
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS student_fts_ad AFTER DELETE ON student BEGIN "
+                    "INSERT INTO student_fts(student_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+                )
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS student_fts_au AFTER UPDATE OF search_text ON student BEGIN "
+                    "INSERT INTO student_fts(student_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+                    "INSERT INTO student_fts(rowid, search_text) VALUES (new.id, new.search_text); END"
+                )
+                conn.exec_driver_sql("INSERT INTO student_fts(student_fts) VALUES ('rebuild')")
+            elif dialect == 'postgresql':
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                conn.exec_driver_sql(
+                    "CREATE INDEX IF NOT EXISTS ix_student_search_trgm ON student USING gin (search_text gin_trgm_ops)"
+                )
+    except Exception as e:
+        print(f"⚠️ Índice de búsqueda no disponible ({e}); se usará el índice en memoria")
+    search_backends.clear()
+
+def upgrade_student_search():
+    """Agrega Student.search_text, lo completa por lotes y crea el índice de búsqueda"""
+    columns = {c['name'] for c in db.inspect(db.engine).get_columns('student')}
+    if 'search_text' not in columns:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ALTER TABLE student ADD COLUMN search_text TEXT')
+    
+    students = Student.__table__
+    while True:
+        rows = db.session.execute(
+            db.select(students.c.id, *[students.c[field] for field in SEARCH_FIELDS])
+            .where(students.c.search_text.is_(None)).limit(SEARCH_BACKFILL_BATCH)
+        ).mappings().all()
+        if not rows:
+            break
+        db.session.execute(
+            db.update(students).where(students.c.id == db.bindparam('student_id')).values(
+                search_text=db.bindparam('text')
+            ),
+            [{'student_id': row['id'], 'text': student_search_text(dict(row))} for row in rows]
+        )
+        db.session.commit()
+    
+    create_search_index()
+
+# === EXPORTACIÓN DE REPORTES (CSV / XLSX EN STREAMING) ===
+REPORT_BATCH_SIZE = 500
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Reporte" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+XLSX_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+class StreamBuffer:
+    """Archivo de solo escritura que entrega lo escrito por partes (sin seek)"""
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    # BOM para que Excel reconozca UTF-8 (tildes y ñ)
+    buffer.write('\ufeff')
+    writer.writerow([header for _, header in columns])
+    
+    for row in rows:
+        writer.writerow(['' if row[key] is None else row[key] for key, _ in columns])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue().encode('utf-8')
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XLSX_INVALID_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def stream_xlsx(rows, columns):
+    """XLSX mínimo (una hoja, textos inline) escrito en streaming dentro del zip"""
+    buffer = StreamBuffer()
+    
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+        workbook.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            ).encode('utf-8'))
+            sheet.write(('<row>' + ''.join(xlsx_cell(header) for _, header in columns) + '</row>').encode('utf-8'))
+            
+            for row in rows:
+                sheet.write(('<row>' + ''.join(xlsx_cell(row[key]) for key, _ in columns) + '</row>').encode('utf-8'))
+                data = buffer.drain()
+                if data:
+                    yield data
+            
+            sheet.write(b'</sheetData></worksheet>')
+    
+    yield buffer.drain()
+
+def export_report(rows, columns, filename):
+    """Respuesta en streaming del reporte según ?format=csv|xlsx"""
+    export_format = request.args.get('format')
+    
+    if export_format == 'csv':
+        body, mimetype = stream_csv(rows, columns), 'text/csv; charset=utf-8'
+    elif export_format == 'xlsx':
+        body, mimetype = stream_xlsx(rows, columns), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        return jsonify({'success': False, 'error': 'Formato no soportado (csv o xlsx)'}), 400
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}_{date.today().isoformat()}.{export_format}'}
+    )
+
 # === FUNCIONES AUXILIARES ===
+STUDENTS_PAGE_SIZE = 50
+STUDENTS_MAX_PAGE_SIZE = 200
+PLANS_PAGE_SIZE = 50
+PLANS_MAX_PAGE_SIZE = 200
+PLAN_BATCH_SIZE = 500
+ACCOUNT_ENTRIES_PAGE_SIZE = 20
+ACCOUNT_ENTRIES_MAX_PAGE_SIZE = 100
+DEBTORS_PAGE_SIZE = 50
+DEBTORS_MAX_PAGE_SIZE = 200
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token, size=2):
+    if not token:
+        return None
+    values = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor inválido')
+    return values
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def birth_date_limit(years):
+    """Fecha de nacimiento de quien cumple `years` años hoy"""
+    today = date.today()
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:  # 29 de febrero
+        return today.replace(year=today.year - years, day=28)
+
+# Campos de Student por grupo; los grupos distintos de 'identity' son columnas diferidas
+STUDENT_FIELD_GROUPS = OrderedDict([
+    ('identity', ['id', 'last_name', 'first_name', 'dni', 'birth_date', 'gender', 'nationality',
+                  'status', 'enrollment_date']),
+    ('contact', ['address', 'phone', 'email', 'photo']),
+    ('parents', ['father_names', 'father_dni', 'father_birth_date', 'father_phone', 'father_email',
+                 'father_occupation', 'mother_names', 'mother_dni', 'mother_birth_date', 'mother_phone',
+                 'mother_email', 'mother_occupation']),
+    ('emergency', ['emergency_contact', 'emergency_relationship', 'emergency_phone', 'emergency_address']),
+    ('medical', ['blood_type', 'height', 'weight', 'allergies', 'medications', 'medical_conditions',
+                 'activity_restrictions', 'vaccines_up_to_date', 'medical_observations']),
+])
+STUDENT_COLUMNS = {field for group in STUDENT_FIELD_GROUPS.values() for field in group}
+STUDENT_DATE_FIELDS = {'birth_date', 'father_birth_date', 'mother_birth_date', 'enrollment_date'}
+
+# Campos por defecto de cada endpoint (las respuestas anteriores a ?fields=)
+STUDENT_LIST_FIELDS = ['id', 'first_name', 'last_name', 'dni', 'birth_date', 'age', 'gender', 'phone', 'status']
+STUDENT_UNENROLLED_FIELDS = ['id', 'first_name', 'last_name', 'dni', 'birth_date', 'age']
+STUDENT_DETAIL_FIELDS = [
+    field for group in STUDENT_FIELD_GROUPS.values() for field in group if field != 'photo'
+]
+
+def parse_student_fields(value, default):
+    """Campos pedidos en ?fields= (columnas, grupos o 'age'); ValueError si alguno no existe"""
+    if not value:
+        return list(default)
+    
+    fields = ['id']
+    for name in value.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name in STUDENT_FIELD_GROUPS:
+            fields.extend(STUDENT_FIELD_GROUPS[name])
+        elif name in STUDENT_COLUMNS or name == 'age':
+            fields.append(name)
+        else:
+            raise ValueError(f'Campo desconocido: {name}')
+    return list(dict.fromkeys(fields))
+
+def student_load_options(fields):
+    """load_only con las columnas necesarias para `fields` (la edad se calcula de birth_date)"""
+    columns = {'birth_date' if field == 'age' else field for field in fields}
+    return db.load_only(*[getattr(Student, column) for column in sorted(columns)])
+
+def filter_students_query(query, args):
+    """Aplica los filtros de la lista de estudiantes (estado, género, edad, aula, búsqueda)"""
+    if args.get('status'):
+        query = query.filter(Student.status == args['status'])
+    if args.get('gender'):
+        query = query.filter(Student.gender == args['gender'])
+    
+    # Rango de edad traducido a rango de fechas de nacimiento
+    if args.get('min_age'):
+        query = query.filter(Student.birth_date <= birth_date_limit(int(args['min_age'])))
+    if args.get('max_age'):
+        query = query.filter(Student.birth_date > birth_date_limit(int(args['max_age']) + 1))
+    
+    if args.get('classroom_id'):
+        classroom_students = db.session.query(Enrollment.student_id).filter_by(
+            classroom_id=int(args['classroom_id']),
+            status='active'
+        )
+        query = query.filter(Student.id.in_(classroom_students))
+    
+    # Búsqueda por prefijo en nombre, apellido o DNI
+    q = (args.get('q') or '').strip()
+    if q:
+        prefix = escape_like(q) + '%'
+        query = query.filter(db.or_(
+            Student.last_name.like(prefix, escape='\\'),
+            Student.first_name.like(prefix, escape='\\'),
+            Student.dni.like(prefix, escape='\\')
+        ))
+    
+    return query
+
+def reserve_classroom_spot(classroom_id):
+    """Ocupa un cupo del aula con un UPDATE condicional; False si está llena o no existe"""
+    result = db.session.execute(
+        db.update(Classroom).where(
+            Classroom.id == classroom_id,
+            db.func.coalesce(Classroom.current_students, 0) < Classroom.capacity
+        ).values(
+            current_students=db.func.coalesce(Classroom.current_students, 0) + 1
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def reserve_classroom_spots(classroom_id, requested):
+    """Ocupa hasta `requested` cupos del aula; devuelve cuántos se reservaron"""
+    count = requested
+    while count > 0:
+        # Aplica si caben `count` cupos más, aunque otro haya cambiado el contador antes
+        current = db.func.coalesce(Classroom.current_students, 0)
+        result = db.session.execute(
+            db.update(Classroom).where(
+                Classroom.id == classroom_id,
+                current + count <= Classroom.capacity
+            ).values(
+                current_students=current + count
+            ).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            return count
+        
+        # No cabían todos: se reintenta con los cupos que quedan libres (0 si el aula está llena)
+        classroom = db.session.execute(
+            db.select(Classroom.capacity, Classroom.current_students).where(Classroom.id == classroom_id)
+        ).first()
+        if not classroom:
+            return 0
+        count = min(requested, classroom.capacity - (classroom.current_students or 0))
+    return 0
+
+def next_receipt_number(day=None):
+    """Siguiente número de recibo del día, sin huecos.
+    
+    El contador se incrementa dentro de la transacción del pago: la fila queda
+    bloqueada hasta el commit y, si el pago falla, el rollback devuelve el número.
+    """
+    day = day or date.today()
+    counters = ReceiptCounter.__table__
+    
+    while True:
+        result = db.session.execute(
+            db.update(counters).where(counters.c.day == day).values(last_number=counters.c.last_number + 1)
+        )
+        if result.rowcount == 1:
+            number = db.session.execute(
+                db.select(counters.c.last_number).where(counters.c.day == day)
+            ).scalar_one()
+            return f"R-{day.strftime('%Y%m%d')}-{number:04d}"
+        
+        # Primer recibo del día: se parte del mayor número ya emitido (recibos antiguos aleatorios)
+        prefix = f"R-{day.strftime('%Y%m%d')}-"
+        issued = db.session.execute(
+            db.select(Payment.receipt_number).where(Payment.receipt_number.like(prefix + '%'))
+        ).scalars()
+        last_number = max((int(r[len(prefix):]) for r in issued if r[len(prefix):].isdigit()), default=0)
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(counters).values(day=day, last_number=last_number))
+        except IntegrityError:
+            # Otro proceso creó la fila del día al mismo tiempo; se vuelve a intentar el UPDATE
+            pass
+
+def release_classroom_spot(classroom_id):
+    db.session.execute(
+        db.update(Classroom).where(
+            Classroom.id == classroom_id,
+            Classroom.current_students > 0
+        ).values(
+            current_students=Classroom.current_students - 1
+        ).execution_options(synchronize_session=False)
+    )
+
+def reconcile_classroom_counters():
+    """Recalcula current_students de todas las aulas a partir de las matrículas activas"""
+    active_count = db.session.query(db.func.count(Enrollment.id)).filter(
+        Enrollment.classroom_id == Classroom.id,
+        Enrollment.status == 'active'
+    ).scalar_subquery()
+    db.session.execute(
+        db.update(Classroom).values(current_students=active_count).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+IMPORT_BATCH_SIZE = 1000
+STUDENT_REQUIRED_FIELDS = ['last_name', 'first_name', 'dni', 'birth_date', 'gender', 'address', 'phone']
+
+def missing_student_field(data):
+    """Primer campo requerido vacío, o None si están todos"""
+    for field in STUDENT_REQUIRED_FIELDS:
+        value = data.get(field)
+        if not value or (isinstance(value, str) and not value.strip()):
+            return field
+    return None
+
+def to_float(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def to_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+    return bool(value)
+
+def student_values(data):
+    """Valores de columna de un estudiante a partir del payload (POST o importación)"""
+    try:
+        birth_date = parse_date(data['birth_date'])
+        father_birth_date = parse_date(data.get('father_birth_date'))
+        mother_birth_date = parse_date(data.get('mother_birth_date'))
+    except ValueError:
+        raise ValueError('Fecha inválida (use YYYY-MM-DD)')
+    
+    values = {
+        # Información Personal
+        'last_name': data['last_name'],
+        'first_name': data['first_name'],
+        'dni': data['dni'],
+        'birth_date': birth_date,
+        'gender': data['gender'],
+        'nationality': data.get('nationality') or 'Peruana',
+        
+        # Información de Contacto
+        'address': data['address'],
+        'phone': data['phone'],
+        'email': data.get('email', ''),
+        
+        # Información del Padre
+        'father_names': data.get('father_names', ''),
+        'father_dni': data.get('father_dni', ''),
+        'father_birth_date': father_birth_date,
+        'father_phone': data.get('father_phone', ''),
+        'father_email': data.get('father_email', ''),
+        'father_occupation': data.get('father_occupation', ''),
+        
+        # Información de la Madre
+        'mother_names': data.get('mother_names', ''),
+        'mother_dni': data.get('mother_dni', ''),
+        'mother_birth_date': mother_birth_date,
+        'mother_phone': data.get('mother_phone', ''),
+        'mother_email': data.get('mother_email', ''),
+        'mother_occupation': data.get('mother_occupation', ''),
+        
+        # Contacto de Emergencia
+        'emergency_contact': data.get('emergency_contact', ''),
+        'emergency_relationship': data.get('emergency_relationship', ''),
+        'emergency_phone': data.get('emergency_phone', ''),
+        'emergency_address': data.get('emergency_address', ''),
+        
+        # Datos Médicos
+        'blood_type': data.get('blood_type', ''),
+        'height': to_float(data.get('height')),
+        'weight': to_float(data.get('weight')),
+        'allergies': data.get('allergies', ''),
+        'medications': data.get('medications', ''),
+        'medical_conditions': data.get('medical_conditions', ''),
+        'activity_restrictions': data.get('activity_restrictions', ''),
+        'vaccines_up_to_date': to_bool(data.get('vaccines_up_to_date')),
+        'medical_observations': data.get('medical_observations', '')
+    }
+    # Las inserciones masivas no pasan por los eventos del mapper
+    values['search_text'] = student_search_text(values)
+    return values
+
+def iter_jsonl(text):
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def parse_date(value):
+    """Convierte 'YYYY-MM-DD' (o ISO con hora) en date; None si viene vacío"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def format_date(value):
+    return value.isoformat() if value else None
+
 def calculate_age(birth_date):
     if not birth_date:
         return 0
-    try:
-        birth = datetime.strptime(birth_date, '%Y-%m-%d')
-        today = datetime.today()
-        age = today.year - birth.year - ((today.month, today.day) < (birth.month, birth.day))
-        return age
-    except:
-        return 0
+    today = date.today()
+    return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+
+def dashboard_counters():
+    """Contadores del dashboard en una sola consulta"""
+    def count(model):
+        return db.select(db.func.count(model.id)).scalar_subquery()
+    
+    years, classrooms, concepts, students = db.session.execute(
+        db.select(count(SchoolYear), count(Classroom), count(PaymentConcept), count(Student))
+    ).one()
+    return {
+        'school_years': years,
+        'classrooms': classrooms,
+        'payment_concepts': concepts,
+        'students': students,
+        'setup_complete': years > 0 and classrooms > 0 and concepts > 0
+    }
+
+# === CUENTA CORRIENTE DE ESTUDIANTES ===
+# Cada plan genera un 'cargo' por su total y cada cuota de mora otro; cada pago de
+# cuota, un 'pago'; un pago suelto (sin cuota) genera su cargo y su pago. StudentAccount acumula los totales
+# con un upsert en la misma transacción, así el saldo se lee con una sola fila.
+ACCOUNT_DEBT_EPSILON = 0.005  # tolerancia de redondeo de los montos Float
+
+def upsert_statement(model):
+    """INSERT ... ON CONFLICT del dialecto activo (SQLite o PostgreSQL)"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+def post_account_entries(entries):
+    """Registra movimientos {student_id, kind, amount, entry_date, ...} y actualiza los saldos"""
+    if not entries:
+        return
+    entries = [dict({'concept_id': None, 'plan_id': None, 'payment_id': None}, **entry) for entry in entries]
+    db.session.execute(db.insert(AccountEntry), entries)
+    
+    totals = {}
+    for entry in entries:
+        total = totals.setdefault(entry['student_id'], {
+            'student_id': entry['student_id'], 'charged': 0.0, 'paid': 0.0, 'balance': 0.0,
+            'last_payment_date': None, 'updated_at': datetime.now()
+        })
+        if entry['kind'] == 'pago':
+            total['paid'] += entry['amount']
+            total['balance'] -= entry['amount']
+            total['last_payment_date'] = max(filter(None, [total['last_payment_date'], entry['entry_date']]))
+        else:
+            total['charged'] += entry['amount']
+            total['balance'] += entry['amount']
+    
+    account = StudentAccount.__table__.c
+    stmt = upsert_statement(StudentAccount)
+    excluded = stmt.excluded
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[account.student_id],
+        set_={
+            'charged': account.charged + excluded.charged,
+            'paid': account.paid + excluded.paid,
+            'balance': account.balance + excluded.balance,
+            'last_payment_date': db.case(
+                (account.last_payment_date.is_(None), excluded.last_payment_date),
+                (excluded.last_payment_date > account.last_payment_date, excluded.last_payment_date),
+                else_=account.last_payment_date
+            ),
+            'updated_at': excluded.updated_at
+        }
+    ), list(totals.values()))
+
+def rebuild_student_accounts():
+    """Reconstruye movimientos y saldos desde planes, pagos y cuotas (en SQL, sin recorrer filas)"""
+    entry = AccountEntry.__table__
+    db.session.execute(db.delete(StudentAccount))
+    db.session.execute(db.delete(AccountEntry))
+    
+    columns = ['student_id', 'kind', 'amount', 'entry_date', 'concept_id', 'plan_id', 'payment_id']
+    paid_installments = db.select(PaymentInstallment.payment_id).where(PaymentInstallment.payment_id.isnot(None))
+    sources = [
+        # Cargo por el total de cada plan
+        db.select(PaymentPlan.student_id, db.literal('cargo'), PaymentPlan.total_amount, PaymentPlan.start_date,
+                  PaymentPlan.concept_id, PaymentPlan.id, db.null()),
+        # Cargo de los pagos sueltos (sin cuota)
+        db.select(Payment.student_id, db.literal('cargo'), Payment.amount, Payment.payment_date,
+                  Payment.concept_id, db.null(), Payment.id).where(Payment.id.notin_(paid_installments)),
+        # Cargo de cada cuota de mora
+        db.select(PaymentPlan.student_id, db.literal('cargo'), PaymentInstallment.amount, PaymentInstallment.due_date,
+                  PaymentPlan.concept_id, PaymentPlan.id, db.null())
+        .join(PaymentPlan, PaymentPlan.id == PaymentInstallment.plan_id)
+        .where(PaymentInstallment.late_fee_for_id.isnot(None)),
+        # Todos los pagos (con el plan de la cuota que pagaron, si la hay)
+        db.select(Payment.student_id, db.literal('pago'), Payment.amount, Payment.payment_date,
+                  Payment.concept_id, PaymentInstallment.plan_id, Payment.id)
+        .outerjoin(PaymentInstallment, PaymentInstallment.payment_id == Payment.id),
+    ]
+    for source in sources:
+        db.session.execute(db.insert(AccountEntry).from_select(columns, source))
+    
+    is_payment = entry.c.kind == 'pago'
+    db.session.execute(db.insert(StudentAccount).from_select(
+        ['student_id', 'charged', 'paid', 'balance', 'last_payment_date', 'updated_at'],
+        db.select(
+            entry.c.student_id,
+            db.func.sum(db.case((is_payment, 0), else_=entry.c.amount)),
+            db.func.sum(db.case((is_payment, entry.c.amount), else_=0)),
+            db.func.sum(db.case((is_payment, -entry.c.amount), else_=entry.c.amount)),
+            db.func.max(db.case((is_payment, entry.c.entry_date))),
+            db.literal(datetime.now())
+        ).group_by(entry.c.student_id)
+    ))
+    db.session.commit()
+    return db.session.query(StudentAccount).count()
+
+# === CUOTAS VENCIDAS Y MORA ===
+# El barrido pasa a 'overdue' las cuotas pendientes ya vencidas, actualiza su tramo
+# de antigüedad y, si LATE_FEE_AMOUNT > 0, agrega una cuota de mora por cada cuota
+# vencida hace más de LATE_FEE_GRACE_DAYS. Todo con UPDATE / INSERT ... SELECT.
+app.config.setdefault('OVERDUE_SWEEP_INTERVAL', int(os.environ.get('OVERDUE_SWEEP_INTERVAL', 3600)))
+app.config.setdefault('LATE_FEE_AMOUNT', float(os.environ.get('LATE_FEE_AMOUNT', 0)))
+app.config.setdefault('LATE_FEE_GRACE_DAYS', int(os.environ.get('LATE_FEE_GRACE_DAYS', 5)))
+AGING_BUCKETS = [(30, '0-30'), (60, '31-60'), (90, '61-90')]
+AGING_BUCKET_OVER = '90+'
+
+overdue_sweeper = None
+overdue_sweeper_lock = threading.Lock()
+
+def aging_bucket_expression(today):
+    """Tramo según los días de atraso (due_date contra `today`)"""
+    return db.case(
+        *[(PaymentInstallment.due_date >= today - timedelta(days=days), label) for days, label in AGING_BUCKETS],
+        else_=AGING_BUCKET_OVER
+    )
+
+def sweep_overdue_installments(today=None, late_fee=0, grace_days=0):
+    today = today or date.today()
+    installment = PaymentInstallment.__table__.c
+    
+    overdue = db.session.execute(db.update(PaymentInstallment).where(
+        PaymentInstallment.status == 'pending',
+        PaymentInstallment.due_date < today
+    ).values(status='overdue')).rowcount
+    
+    # Solo se reescriben las cuotas que cambian de tramo
+    bucket = aging_bucket_expression(today)
+    db.session.execute(db.update(PaymentInstallment).where(
+        PaymentInstallment.status == 'overdue',
+        db.or_(PaymentInstallment.aging_bucket.is_(None), PaymentInstallment.aging_bucket != bucket)
+    ).values(aging_bucket=bucket))
+    
+    fees = []
+    if late_fee > 0:
+        fee_installment = db.aliased(PaymentInstallment)
+        candidates = db.select(
+            installment.plan_id, installment.installment_number, db.literal(today), db.literal(late_fee),
+            db.literal('pending'), installment.id
+        ).where(
+            installment.status == 'overdue',
+            installment.late_fee_for_id.is_(None),
+            installment.due_date < today - timedelta(days=grace_days),
+            ~db.exists().where(fee_installment.late_fee_for_id == installment.id)
+        )
+        fees = db.session.execute(
+            db.insert(PaymentInstallment).from_select(
+                ['plan_id', 'installment_number', 'due_date', 'amount', 'status', 'late_fee_for_id'], candidates
+            ).returning(PaymentInstallment.id, PaymentInstallment.plan_id)
+        ).all()
+        
+        # La mora es un cargo más en la cuenta corriente del estudiante
+        plans = {plan_id: (student_id, concept_id) for plan_id, student_id, concept_id in db.session.execute(
+            db.select(PaymentPlan.id, PaymentPlan.student_id, PaymentPlan.concept_id)
+            .where(PaymentPlan.id.in_({plan_id for _, plan_id in fees}))
+        )} if fees else {}
+        post_account_entries([{
+            'student_id': plans[plan_id][0],
+            'kind': 'cargo',
+            'amount': late_fee,
+            'entry_date': today,
+            'concept_id': plans[plan_id][1],
+            'plan_id': plan_id
+        } for _, plan_id in fees])
+    
+    db.session.commit()
+    return {'overdue': overdue, 'late_fees': len(fees)}
+
+def run_overdue_sweeper(interval):
+    while True:
+        try:
+            with app.app_context():
+                result = sweep_overdue_installments(
+                    late_fee=app.config['LATE_FEE_AMOUNT'], grace_days=app.config['LATE_FEE_GRACE_DAYS']
+                )
+            if result['overdue'] or result['late_fees']:
+                print(f"⏰ Cuotas vencidas: {result['overdue']}, cuotas de mora: {result['late_fees']}")
+        except IntegrityError:
+            pass  # otro worker agregó la misma mora (índice único de late_fee_for_id)
+        except Exception as e:
+            print("❌ Error en el barrido de cuotas vencidas:", str(e))
+        time.sleep(interval)
+
+def start_overdue_sweeper():
+    """Hilo del barrido periódico, uno por proceso (OVERDUE_SWEEP_INTERVAL=0 lo desactiva)"""
+    global overdue_sweeper
+    interval = app.config['OVERDUE_SWEEP_INTERVAL']
+    if overdue_sweeper is not None or interval <= 0 or app.testing:
+        return
+    with overdue_sweeper_lock:
+        if overdue_sweeper is None:
+            overdue_sweeper = threading.Thread(
+                target=run_overdue_sweeper, args=(interval,), name='overdue-sweeper', daemon=True
+            )
+            overdue_sweeper.start()
+
+def add_overdue_columns():
+    """Agrega tramo y cuota de mora a PaymentInstallment (si faltan)"""
+    columns = {c['name'] for c in db.inspect(db.engine).get_columns('payment_installment')}
+    with db.engine.begin() as conn:
+        if 'aging_bucket' not in columns:
+            conn.exec_driver_sql('ALTER TABLE payment_installment ADD COLUMN aging_bucket VARCHAR(10)')
+        if 'late_fee_for_id' not in columns:
+            conn.exec_driver_sql(
+                'ALTER TABLE payment_installment ADD COLUMN late_fee_for_id INTEGER REFERENCES payment_installment (id)'
+            )
+
+def upgrade_overdue_sweeper():
+    """Crea los índices del barrido y marca las cuotas ya vencidas"""
+    add_overdue_columns()
+    create_indexes('ix_payment_installment_late_fee_for_id', 'ix_payment_installment_status_aging')
+    sweep_overdue_installments()
+
+# === SERIALIZACIÓN JSON ===
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask que usa orjson cuando está instalado.
+    Conserva el formato del proveedor por defecto (claves ordenadas, fechas HTTP,
+    Decimal como texto); en modo debug o con argumentos de json.dumps delega en él."""
+    orjson_options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+    
+    def encode(self, obj):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self.orjson_options)
+        except TypeError:  # enteros de más de 64 bits u otros tipos que orjson no admite
+            return super().dumps(obj).encode()
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+    
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+class Serializer:
+    """Serializador declarativo, compilado una sola vez al definirlo.
+    Cada campo es una ruta de atributos ('student.dni'), una tupla (ruta, formato)
+    o una función que recibe el objeto. Con ellos se genera el código de un dict
+    literal, tan rápido como escribirlo a mano; sirve para modelos y para filas."""
+    def __init__(self, **fields):
+        self.fields = fields
+        namespace = {}
+        items = []
+        for index, (key, spec) in enumerate(fields.items()):
+            name = f'_f{index}'
+            if callable(spec):
+                namespace[name] = spec
+                items.append(f'{key!r}: {name}(obj)')
+                continue
+            path, formatter = spec if isinstance(spec, tuple) else (spec, None)
+            if not all(part.isidentifier() for part in path.split('.')):
+                raise ValueError(f'Ruta de atributo inválida: {path}')
+            expr = 'obj.' + path
+            if formatter is not None:
+                namespace[name] = formatter
+                expr = f'{name}({expr})'
+            items.append(f'{key!r}: {expr}')
+        
+        body = '{' + ', '.join(items) + '}'
+        exec(f'def one(obj):\n    return {body}\n'
+             f'def many(objects):\n    return [{body} for obj in objects]\n', namespace)
+        self.one = namespace['one']
+        self.many = namespace['many']
+    
+    def __call__(self, obj):
+        return self.one(obj)
+    
+    def extend(self, exclude=(), **fields):
+        """Otro serializador con los mismos campos, menos `exclude` y más `fields`"""
+        merged = {key: spec for key, spec in self.fields.items() if key not in exclude}
+        merged.update(fields)
+        return Serializer(**merged)
+
+def full_name(path=None):
+    """Campo calculado 'nombres apellidos' del alumno en `path` (o del propio objeto)"""
+    prefix = path + '.' if path else ''
+    names = operator.attrgetter(prefix + 'first_name', prefix + 'last_name')
+    return lambda obj: '%s %s' % names(obj)
+
+def format_short_date(value):
+    return value.strftime('%d/%m/%Y') if value else ''
+
+def int_or_zero(value):
+    return int(value or 0)
+
+def float_or_zero(value):
+    return float(value or 0)
+
+@functools.lru_cache(maxsize=64)
+def student_serializer(fields):
+    """Serializador de Student para una tupla de campos de parse_student_fields"""
+    spec = {}
+    for field in fields:
+        if field == 'age':
+            spec['age'] = ('birth_date', calculate_age)
+        elif field in STUDENT_DATE_FIELDS:
+            spec[field] = (field, format_date)
+        else:
+            spec[field] = field
+    return Serializer(**spec)
+
+SCHOOL_YEAR_SERIALIZER = Serializer(
+    id='id', year='year', start_date=('start_date', format_date), end_date=('end_date', format_date)
+)
+CLASSROOM_SERIALIZER = Serializer(
+    id='id', name='name', age_range='age_range', capacity='capacity', current_students='current_students'
+)
+AVAILABLE_CLASSROOM_SERIALIZER = CLASSROOM_SERIALIZER.extend(
+    exclude=('current_students',),
+    current_enrollments=('current_students', int_or_zero),
+    available_spots=lambda c: c.capacity - (c.current_students or 0)
+)
+PAYMENT_CONCEPT_SERIALIZER = Serializer(
+    id='id', name='name', description='description', amount='amount', frequency='frequency'
+)
+
+ENROLLMENT_SERIALIZER = Serializer(
+    id='id',
+    student_id='student_id',
+    student_name=full_name('student'),
+    student_dni='student.dni',
+    classroom_id='classroom_id',
+    classroom_name='classroom.name',
+    enrollment_date=('enrollment_date', format_date),
+    status='status'
+)
+ENROLLMENT_DETAIL_SERIALIZER = ENROLLMENT_SERIALIZER.extend(exclude=('student_id',))
+ENROLLMENT_EDIT_SERIALIZER = ENROLLMENT_SERIALIZER.extend(exclude=('student_dni',))
+ENROLLED_STUDENT_SERIALIZER = Serializer(
+    id='student.id', name=full_name('student'), dni='student.dni', classroom='classroom.name'
+)
+CERTIFICATE_SERIALIZER = Serializer(
+    enrollment_id='id',
+    student_name=full_name('student'),
+    student_dni='student.dni',
+    student_birth_date=('student.birth_date', format_short_date),
+    classroom_name='classroom.name',
+    classroom_age_range='classroom.age_range',
+    enrollment_date=('enrollment_date', format_short_date)
+)
+
+PAYMENT_SERIALIZER = Serializer(
+    id='id',
+    student_name=full_name('student'),
+    student_dni='student.dni',
+    concept_name='concept.name',
+    amount='amount',
+    payment_date=('payment_date', format_date),
+    due_date=('due_date', format_date),
+    status='status',
+    receipt_number='receipt_number'
+)
+RECEIPT_SERIALIZER = PAYMENT_SERIALIZER.extend(exclude=('id',))
+
+# Filas (PaymentPlan, progreso) de get_payment_plans
+PAYMENT_PLAN_SERIALIZER = Serializer(
+    id='PaymentPlan.id',
+    student_id='PaymentPlan.student_id',
+    student_name=full_name('PaymentPlan.student'),
+    student_dni='PaymentPlan.student.dni',
+    concept_id='PaymentPlan.concept_id',
+    concept_name='PaymentPlan.concept.name',
+    total_amount='PaymentPlan.total_amount',
+    installments='PaymentPlan.installments',
+    paid_installments=('paid_installments', int_or_zero),
+    paid_amount=('paid_amount', float_or_zero),
+    pending_amount=('pending_amount', float_or_zero),
+    next_due_date=('next_due_date', format_date),
+    overdue_installments=('overdue_installments', int_or_zero),
+    start_date=('PaymentPlan.start_date', format_date),
+    status='PaymentPlan.status',
+    created_date=('PaymentPlan.created_date', format_date)
+)
+
+INSTALLMENT_SERIALIZER = Serializer(
+    id='id',
+    installment_number='installment_number',
+    due_date=('due_date', format_date),
+    amount='amount',
+    status='status',
+    payment_date=('payment_date', format_date),
+    payment_id='payment_id',
+    late_fee_for_id='late_fee_for_id'  # cuota de mora: id de la cuota vencida que la originó
+)
+INSTALLMENT_DETAIL_SERIALIZER = INSTALLMENT_SERIALIZER.extend(
+    student_name=full_name('plan.student'),
+    student_dni='plan.student.dni',
+    concept_name='plan.concept.name'
+)
+INSTALLMENT_DUE_SERIALIZER = INSTALLMENT_DETAIL_SERIALIZER.extend(exclude=('payment_id',), plan_id='plan_id')
+
+UTIL_SERIALIZER = Serializer(
+    id='id',
+    aula_id='aula_id',
+    material='material',
+    cantidad_requerida='cantidad_requerida',
+    especificaciones='especificaciones',
+    created_at=('created_at', format_date),
+    aula_nombre=('aula', lambda aula: aula.name if aula else '')
+)
+UTIL_AULA_SERIALIZER = UTIL_SERIALIZER.extend(exclude=('aula_id', 'created_at', 'aula_nombre'))
+ESTUDIANTE_AULA_SERIALIZER = Serializer(id='id', nombre=full_name(), dni='dni')
+ENTREGA_SERIALIZER = Serializer(
+    id='id',
+    estudiante_id='estudiante_id',
+    util_id='util_id',
+    cantidad_entregada='cantidad_entregada',
+    fecha_entrega=('fecha_entrega', format_date),
+    observaciones='observaciones'
+)
+
+def round_amount(value):
+    return round(value or 0, 2)
+
+STUDENT_ACCOUNT_SERIALIZER = Serializer(
+    student_id='student_id',
+    charged=('charged', round_amount),
+    paid=('paid', round_amount),
+    balance=('balance', round_amount),
+    last_payment_date=('last_payment_date', format_date)
+)
+DEBTOR_SERIALIZER = STUDENT_ACCOUNT_SERIALIZER.extend(
+    student_name=full_name('student'),
+    student_dni='student.dni'
+)
+ACCOUNT_ENTRY_SERIALIZER = Serializer(
+    id='id',
+    kind='kind',
+    amount='amount',
+    entry_date=('entry_date', format_date),
+    concept_name=('concept', lambda concept: concept.name if concept else None),
+    plan_id='plan_id',
+    payment_id='payment_id'
+)
+
+JOB_SERIALIZER = Serializer(
+    id='id',
+    endpoint='endpoint',
+    status='status',
+    attempts='attempts',
+    created_at=('created_at', format_date),
+    started_at=('started_at', format_date),
+    finished_at=('finished_at', format_date),
+    error='error',
+    result_url=lambda job: f'/api/jobs/{job.id}/result' if job.status in ('done', 'failed') else None
+)
 
 def create_superadmin():
     if User.query.count() == 0:
@@ -1598,12 +4186,603 @@ def create_superadmin():
         db.session.commit()
         print("✅ Superadmin creado: usuario=admin, contraseña=R@nny1511")
 
+def upgrade_date_columns():
+    """Convierte a Date/DateTime las columnas de fecha que en bases antiguas eran texto"""
+    inspector = db.inspect(db.engine)
+    dialect = db.engine.dialect.name
+    quote = db.engine.dialect.identifier_preparer.quote
+    
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name']: c['type'] for c in inspector.get_columns(table.name)}
+            
+            for column in table.columns:
+                if not isinstance(column.type, (db.Date, db.DateTime)):
+                    continue
+                if not isinstance(existing.get(column.name), db.String):
+                    continue
+                
+                is_datetime = isinstance(column.type, db.DateTime)
+                t, c = quote(table.name), quote(column.name)
+                
+                if dialect == 'postgresql':
+                    target, cast = ('TIMESTAMP', '::timestamp') if is_datetime else ('DATE', '::timestamp::date')
+                    conn.execute(db.text(
+                        f"ALTER TABLE {t} ALTER COLUMN {c} TYPE {target} USING NULLIF({c}, ''){cast}"
+                    ))
+                elif dialect == 'sqlite':
+                    # SQLite no cambia el tipo declarado; basta con normalizar el texto al formato de SQLAlchemy
+                    conn.execute(db.text(f"UPDATE {t} SET {c} = NULL WHERE {c} = ''"))
+                    if is_datetime:
+                        conn.execute(db.text(f"UPDATE {t} SET {c} = replace({c}, 'T', ' ') WHERE {c} LIKE '%T%'"))
+                    else:
+                        conn.execute(db.text(f"UPDATE {t} SET {c} = substr({c}, 1, 10) WHERE length({c}) > 10"))
+                else:
+                    print(f"⚠️ No se puede migrar {table.name}.{column.name} en {dialect}")
+
+def create_indexes(*names):
+    """Crea los índices declarados en los modelos; create_all() no los agrega a tablas existentes"""
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=db.engine, checkfirst=True)
+
+# Migraciones versionadas: se aplican en orden y cada una se registra en SchemaMigration.
+# Deben ser idempotentes, porque en una base nueva create_all() ya dejó el esquema final.
+MIGRATIONS = [
+    (1, 'Fechas como Date/DateTime', upgrade_date_columns),
+    (2, 'Índices de paginación de estudiantes y de fechas de pago', lambda: create_indexes(
+        'ix_student_last_name_id', 'ix_student_first_name', 'ix_student_status', 'ix_student_birth_date',
+        'ix_payment_due_date', 'ix_payment_payment_date',
+        'ix_payment_installment_due_date', 'ix_payment_installment_payment_date'
+    )),
+    (3, 'Índices de claves foráneas y estados', lambda: create_indexes(
+        'ix_enrollment_student_status', 'ix_enrollment_classroom_status', 'ix_enrollment_status_student',
+        'ix_payment_student_id', 'ix_payment_plan_student_id',
+        'ix_payment_installment_plan_status', 'ix_payment_installment_status_due_date',
+        'ix_almacen_util_aula_id', 'ix_almacen_entrega_estudiante_util', 'ix_almacen_entrega_util_id'
+    )),
+    (4, 'Búsqueda de estudiantes (search_text + FTS5 / pg_trgm)', upgrade_student_search),
+    # La reconstrucción ya lee late_fee_for_id, que agrega la migración 6
+    (5, 'Cuenta corriente de estudiantes (movimientos y saldos)', lambda: (
+        add_overdue_columns(), rebuild_student_accounts()
+    )),
+    (6, 'Cuotas vencidas: estado overdue, tramos y mora', upgrade_overdue_sweeper),
+    (7, 'Índices de búsqueda por prefijo (varchar_pattern_ops, solo Postgres)', lambda: create_indexes(
+        'ix_student_last_name_pattern', 'ix_student_first_name_pattern', 'ix_student_dni_pattern'
+    )),
+]
+
+def run_migrations():
+    db.create_all()
+    applied = {m.version for m in SchemaMigration.query.all()}
+    
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"⏳ Aplicando migración {version}: {name}")
+        migrate()
+        db.session.add(SchemaMigration(version=version, name=name))
+        db.session.commit()
+    
+    seed_table_versions()
+    return [version for version, _, _ in MIGRATIONS if version not in applied]
+
+def explain_statement(connection, statement, parameters):
+    """Plan de ejecución de una sentencia SQL según el motor"""
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).all()
+    return [row[0] for row in rows]
+
 def init_database():
     with app.app_context():
-        db.create_all()
+        run_migrations()
         create_superadmin()
+        reconcile_classroom_counters()
         print("✅ Base de datos lista - Los datos son PERMANENTES")
 
+def admin_test_client():
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+        sess['role'] = 'superadmin'
+    return client
+
+def api_get_requests():
+    """(endpoint, url, parámetros) de cada GET /api/*, con ids y filtros de ejemplo"""
+    # Parámetros de ejemplo para las rutas que los requieren
+    sample_args = {
+        '/api/installments': {'from_date': date.today().replace(day=1).isoformat(), 'to_date': date.today().isoformat()},
+        '/api/students': {'limit': 50, 'q': 'a'},
+        '/api/students/search': {'q': 'nunez'},
+        '/api/payment-plans': {'limit': 50},
+    }
+    # El flujo en vivo no termina nunca, así que no se mide
+    rules = sorted(
+        (r for r in app.url_map.iter_rules()
+         if r.rule.startswith('/api/') and 'GET' in r.methods
+         and r.endpoint not in ('logout', 'live_events_stream')),
+        key=lambda r: r.rule
+    )
+    requests_to_run = []
+    for rule in rules:
+        url = rule.rule
+        url = re.sub(r'<(?:\w+:)?\w+>', '1', url)
+        requests_to_run.append((rule.endpoint, url, sample_args.get(rule.rule, {})))
+    return requests_to_run
+
+# === DATOS SINTÉTICOS Y BENCHMARK ===
+SEED_CHUNK_SIZE = 2000
+SEED_FIRST_NAMES = ['Ana', 'Luis', 'María', 'José', 'Carmen', 'Jorge', 'Rosa', 'Carlos', 'Lucía', 'Miguel',
+                    'Sofía', 'Diego', 'Valeria', 'Mateo', 'Camila', 'Santiago', 'Isabella', 'Sebastián',
+                    'Daniela', 'Gabriel', 'Fernanda', 'Adrián', 'Mariana', 'Thiago', 'Antonella']
+SEED_LAST_NAMES = ['Quispe', 'Flores', 'Sánchez', 'Rodríguez', 'García', 'Rojas', 'Huamán', 'Mamani',
+                   'Vásquez', 'Chávez', 'Ramírez', 'Torres', 'Castillo', 'Mendoza', 'Díaz', 'Gonzales',
+                   'Pérez', 'Cruz', 'Gutiérrez', 'Romero', 'Salazar', 'Vargas', 'Reyes', 'Ruiz', 'Nuñez']
+SEED_UTILES = ['Cuaderno cuadriculado', 'Lápiz', 'Borrador', 'Colores', 'Plastilina', 'Témperas',
+               'Papel bond', 'Goma', 'Tijera punta roma', 'Cartulina', 'Crayones', 'Plumones',
+               'Papel lustre', 'Pincel', 'Folder', 'Punzón', 'Cinta masking', 'Libro de cuentos']
+SEED_CATEGORIAS = ['Escritorio', 'Arte', 'Limpieza', 'Didáctico', 'Mobiliario', 'Tecnología']
+BENCHMARK_NOISE_MS = 2.0
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def bulk_insert(model, rows):
+    for offset in range(0, len(rows), SEED_CHUNK_SIZE):
+        db.session.execute(db.insert(model), rows[offset:offset + SEED_CHUNK_SIZE])
+
+def sync_id_sequences(models):
+    """En PostgreSQL las secuencias no avanzan al insertar ids explícitos"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 1))"
+        ))
+
+def seed_dataset(classrooms, students, installments, utiles, materials, bienes, rng):
+    """Genera datos de prueba con ids explícitos e inserciones masivas; devuelve el conteo por tabla"""
+    today = date.today()
+    counts = {}
+    
+    year = str(today.year)
+    school_year = SchoolYear.query.filter_by(year=year).first()
+    if not school_year:
+        school_year = SchoolYear(year=year, start_date=date(today.year, 3, 1), end_date=date(today.year, 12, 20))
+        db.session.add(school_year)
+        db.session.flush()
+    
+    # Aulas con capacidad suficiente para todos los alumnos activos
+    capacity = math.ceil(students / max(classrooms, 1)) + 5
+    first = next_id(Classroom)
+    classroom_ids = list(range(first, first + classrooms))
+    bulk_insert(Classroom, [{
+        'id': classroom_id,
+        'name': f'Aula {classroom_id}',
+        'age_range': f'{3 + classroom_id % 3} años',
+        'capacity': capacity,
+        'current_students': 0
+    } for classroom_id in classroom_ids])
+    counts['classroom'] = classrooms
+    
+    first = next_id(PaymentConcept)
+    pension_id, matricula_id = first, first + 1
+    bulk_insert(PaymentConcept, [
+        {'id': pension_id, 'name': 'Pensión mensual', 'description': 'Pensión', 'amount': 250.0, 'frequency': 'mensual'},
+        {'id': matricula_id, 'name': 'Matrícula', 'description': 'Matrícula anual', 'amount': 300.0, 'frequency': 'anual'},
+    ])
+    
+    # Estudiantes: 97% activos, todos los activos matriculados
+    known_dnis = set(db.session.execute(db.select(Student.dni)).scalars())
+    first = next_id(Student)
+    student_rows = []
+    enrollment_rows = []
+    enrollment_id = next_id(Enrollment)
+    active_students = []
+    for student_id in range(first, first + students):
+        dni = f'{60000000 + student_id:08d}'
+        while dni in known_dnis:
+            dni = f'{rng.randint(10000000, 99999999)}'
+        known_dnis.add(dni)
+        status = 'active' if rng.random() < 0.97 else 'inactive'
+        student_rows.append({
+            'id': student_id,
+            'last_name': f'{rng.choice(SEED_LAST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+            'first_name': rng.choice(SEED_FIRST_NAMES),
+            'dni': dni,
+            'birth_date': today - timedelta(days=rng.randint(2 * 365, 6 * 365)),
+            'gender': rng.choice(['Masculino', 'Femenino']),
+            'nationality': 'Peruana',
+            'address': f'Av. Los Olivos {rng.randint(100, 2000)}',
+            'phone': f'9{rng.randint(10000000, 99999999)}',
+            'email': f'familia{student_id}@correo.pe',
+            'father_names': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+            'mother_names': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+            'emergency_contact': rng.choice(SEED_FIRST_NAMES),
+            'emergency_phone': f'9{rng.randint(10000000, 99999999)}',
+            'blood_type': rng.choice(['O+', 'A+', 'B+', 'AB+']),
+            'height': round(rng.uniform(85, 120), 1),
+            'weight': round(rng.uniform(11, 25), 1),
+            'vaccines_up_to_date': rng.random() < 0.9,
+            'status': status
+        })
+        if status == 'active' and classroom_ids:
+            classroom_id = classroom_ids[len(active_students) % classrooms]
+            active_students.append((student_id, classroom_id))
+            enrollment_rows.append({
+                'id': enrollment_id,
+                'student_id': student_id,
+                'classroom_id': classroom_id,
+                'enrollment_date': school_year.start_date - timedelta(days=rng.randint(0, 60)),
+                'status': 'active'
+            })
+            enrollment_id += 1
+    for row in student_rows:
+        row['search_text'] = student_search_text(row)
+    bulk_insert(Student, student_rows)
+    bulk_insert(Enrollment, enrollment_rows)
+    counts['student'] = len(student_rows)
+    counts['enrollment'] = len(enrollment_rows)
+    
+    # Un plan de pensiones por alumno matriculado; las cuotas vencidas se pagan en un 80%
+    due_dates = installment_schedule(school_year.start_date, installments)
+    receipt_counters = dict(db.session.execute(
+        db.select(ReceiptCounter.day, ReceiptCounter.last_number)
+    ).all())
+    plan_id = next_id(PaymentPlan)
+    payment_id = next_id(Payment)
+    installment_id = next_id(PaymentInstallment)
+    plan_rows, installment_rows_, payment_rows = [], [], []
+    for student_id, _ in active_students:
+        plan_rows.append({
+            'id': plan_id,
+            'student_id': student_id,
+            'concept_id': pension_id,
+            'total_amount': 250.0 * installments,
+            'installments': installments,
+            'start_date': school_year.start_date,
+            'status': 'active'
+        })
+        for number, due_date in enumerate(due_dates, start=1):
+            row = {
+                'id': installment_id,
+                'plan_id': plan_id,
+                'installment_number': number,
+                'due_date': due_date,
+                'amount': 250.0,
+                'status': 'pending',
+                'payment_date': None,
+                'payment_id': None
+            }
+            if due_date < today and rng.random() < 0.8:
+                paid_on = due_date - timedelta(days=rng.randint(0, 20))
+                receipt_counters[paid_on] = receipt_counters.get(paid_on, 0) + 1
+                payment_rows.append({
+                    'id': payment_id,
+                    'student_id': student_id,
+                    'concept_id': pension_id,
+                    'amount': 250.0,
+                    'payment_date': paid_on,
+                    'due_date': due_date,
+                    'status': 'pagado',
+                    'receipt_number': f"R-{paid_on.strftime('%Y%m%d')}-{receipt_counters[paid_on]:04d}"
+                })
+                row.update(status='paid', payment_date=paid_on, payment_id=payment_id)
+                payment_id += 1
+            installment_rows_.append(row)
+            installment_id += 1
+        plan_id += 1
+    bulk_insert(PaymentPlan, plan_rows)
+    bulk_insert(Payment, payment_rows)
+    bulk_insert(PaymentInstallment, installment_rows_)
+    counts['payment_plan'] = len(plan_rows)
+    counts['payment_installment'] = len(installment_rows_)
+    counts['payment'] = len(payment_rows)
+    
+    # Los contadores de recibos continúan desde lo generado
+    db.session.execute(db.delete(ReceiptCounter).where(ReceiptCounter.day.in_(list(receipt_counters))))
+    bulk_insert(ReceiptCounter, [{'day': day, 'last_number': n} for day, n in receipt_counters.items()])
+    
+    # Útiles por aula y la grilla de entregas alumno × útil
+    util_id = next_id(AlmacenUtil)
+    utiles_by_classroom = {}
+    util_rows = []
+    for classroom_id in classroom_ids:
+        for material in rng.sample(SEED_UTILES, min(utiles, len(SEED_UTILES))):
+            required = rng.randint(1, 5)
+            util_rows.append({
+                'id': util_id,
+                'aula_id': classroom_id,
+                'material': material,
+                'cantidad_requerida': required,
+                'especificaciones': ''
+            })
+            utiles_by_classroom.setdefault(classroom_id, []).append((util_id, required))
+            util_id += 1
+    entrega_rows = []
+    entrega_id = next_id(AlmacenEntrega)
+    for student_id, classroom_id in active_students:
+        for util, required in utiles_by_classroom.get(classroom_id, []):
+            if rng.random() < 0.7:
+                entrega_rows.append({
+                    'id': entrega_id,
+                    'estudiante_id': student_id,
+                    'util_id': util,
+                    'cantidad_entregada': rng.randint(1, required),
+                    'fecha_entrega': school_year.start_date + timedelta(days=rng.randint(0, 30)),
+                    'observaciones': ''
+                })
+                entrega_id += 1
+    bulk_insert(AlmacenUtil, util_rows)
+    bulk_insert(AlmacenEntrega, entrega_rows)
+    counts['almacen_util'] = len(util_rows)
+    counts['almacen_entrega'] = len(entrega_rows)
+    
+    # Materiales con movimientos y bienes con mantenimientos
+    material_id = next_id(MaterialAula)
+    movimiento_id = next_id(MovimientoMaterial)
+    material_rows, movimiento_rows = [], []
+    for offset in range(materials):
+        minimum = rng.randint(5, 50)
+        material_rows.append({
+            'id': material_id + offset,
+            'nombre': f'{rng.choice(SEED_UTILES)} {offset + 1}',
+            'categoria': rng.choice(SEED_CATEGORIAS),
+            'stock_actual': rng.randint(0, minimum * 3),
+            'stock_minimo': minimum,
+            'unidad_medida': 'unidades',
+            'ubicacion': f'Estante {rng.randint(1, 20)}',
+            'proveedor': 'Proveedor escolar'
+        })
+        for _ in range(3):
+            movimiento_rows.append({
+                'id': movimiento_id,
+                'material_id': material_id + offset,
+                'tipo': rng.choice(['entrada', 'salida']),
+                'cantidad': rng.randint(1, 20),
+                'motivo': 'Reposición',
+                'responsable': 'admin'
+            })
+            movimiento_id += 1
+    bulk_insert(MaterialAula, material_rows)
+    bulk_insert(MovimientoMaterial, movimiento_rows)
+    counts['material_aula'] = len(material_rows)
+    counts['movimiento_material'] = len(movimiento_rows)
+    
+    bien_id = next_id(BienAula)
+    mantenimiento_id = next_id(MantenimientoBien)
+    bien_rows, mantenimiento_rows = [], []
+    for offset in range(bienes):
+        bien_rows.append({
+            'id': bien_id + offset,
+            'codigo_patrimonial': f'PAT-{bien_id + offset:06d}',
+            'nombre': rng.choice(['Mesa', 'Silla', 'Pizarra', 'Estante', 'Proyector', 'Computadora']),
+            'categoria': rng.choice(SEED_CATEGORIAS),
+            'estado': rng.choice(['bueno', 'bueno', 'regular', 'malo']),
+            'aula_id': rng.choice(classroom_ids) if classroom_ids else None,
+            'fecha_adquisicion': today - timedelta(days=rng.randint(30, 3000)),
+            'valor_adquisicion': round(rng.uniform(50, 3000), 2)
+        })
+        if offset % 3 == 0:
+            mantenimiento_rows.append({
+                'id': mantenimiento_id,
+                'bien_id': bien_id + offset,
+                'tipo_mantenimiento': 'preventivo',
+                'fecha_mantenimiento': today - timedelta(days=rng.randint(1, 365)),
+                'descripcion': 'Revisión general',
+                'costo': round(rng.uniform(20, 300), 2)
+            })
+            mantenimiento_id += 1
+    bulk_insert(BienAula, bien_rows)
+    bulk_insert(MantenimientoBien, mantenimiento_rows)
+    counts['bien_aula'] = len(bien_rows)
+    counts['mantenimiento_bien'] = len(mantenimiento_rows)
+    
+    reconcile_classroom_counters()
+    sync_id_sequences([Classroom, PaymentConcept, Student, Enrollment, PaymentPlan, Payment,
+                       PaymentInstallment, AlmacenUtil, AlmacenEntrega, MaterialAula,
+                       MovimientoMaterial, BienAula, MantenimientoBien])
+    db.session.commit()
+    sweep_overdue_installments()
+    counts['student_account'] = rebuild_student_accounts()
+    return counts
+
+def percentile(values, pct):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+def run_benchmark(iterations):
+    """Latencia (ms) y consultas SQL de cada GET /api/*, sin caché de respuestas"""
+    query_count = [0]
+    thread = threading.get_ident()
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        # Las consultas de los trabajos en segundo plano no cuentan para la ruta
+        if threading.get_ident() == thread:
+            query_count[0] += 1
+    
+    client = admin_test_client()
+    results = {}
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    try:
+        for endpoint, url, query_string in api_get_requests():
+            timings, queries, status = [], [], None
+            for attempt in range(iterations + 1):
+                response_cache.clear()
+                query_count[0] = 0
+                started = time.perf_counter()
+                response = client.get(url, query_string=query_string)
+                response.get_data()
+                response.close()
+                elapsed = (time.perf_counter() - started) * 1000
+                status = response.status_code
+                # La primera ejecución solo calienta conexiones y plantillas
+                if attempt:
+                    timings.append(elapsed)
+                    queries.append(query_count[0])
+            timings.sort()
+            results[endpoint] = {
+                'url': url,
+                'status': status,
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'queries': max(queries),
+                'budget': getattr(app.view_functions[endpoint], 'query_budget', None)
+            }
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+    return results
+
+def compare_benchmark(results, baseline, tolerance):
+    """Endpoints fuera de su presupuesto de consultas o peores que la línea base"""
+    regressions = {}
+    for endpoint, current in results.items():
+        reasons = []
+        if current['budget'] is not None and current['queries'] > current['budget']:
+            reasons.append(f"{current['queries']} consultas, presupuesto {current['budget']}")
+        
+        previous = baseline.get(endpoint)
+        if previous:
+            slower = current['p95_ms'] - previous['p95_ms']
+            if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance) and slower > BENCHMARK_NOISE_MS:
+                reasons.append(f"p95 {previous['p95_ms']} → {current['p95_ms']} ms")
+            if current['queries'] > previous['queries']:
+                reasons.append(f"consultas {previous['queries']} → {current['queries']}")
+            if current['status'] != previous['status']:
+                reasons.append(f"estado {previous['status']} → {current['status']}")
+        if reasons:
+            regressions[endpoint] = reasons
+    return regressions
+
+# === COMANDOS DE MANTENIMIENTO (flask --app app <comando>) ===
+@app.cli.command('reconcile-classrooms')
+def reconcile_classrooms_command():
+    """Reconstruye los contadores de ocupación de aulas desde Enrollment"""
+    reconcile_classroom_counters()
+    print("✅ Contadores de ocupación de aulas recalculados")
+
+@app.cli.command('rebuild-accounts')
+def rebuild_accounts_command():
+    """Reconstruye la cuenta corriente (movimientos y saldos) de todos los estudiantes"""
+    accounts = rebuild_student_accounts()
+    print(f"✅ Cuentas corrientes recalculadas ({accounts} estudiantes con movimientos)")
+
+@app.cli.command('sweep-overdue')
+@click.option('--late-fee', type=float, default=None, help='Monto de la cuota de mora (por defecto LATE_FEE_AMOUNT; 0 = sin mora)')
+@click.option('--grace-days', type=int, default=None, help='Días de gracia antes de cobrar mora (por defecto LATE_FEE_GRACE_DAYS)')
+@click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Fecha del barrido (por defecto hoy)')
+def sweep_overdue_command(late_fee, grace_days, today):
+    """Marca las cuotas vencidas, actualiza sus tramos y agrega la mora (para cron)"""
+    result = sweep_overdue_installments(
+        today=today.date() if today else None,
+        late_fee=app.config['LATE_FEE_AMOUNT'] if late_fee is None else late_fee,
+        grace_days=app.config['LATE_FEE_GRACE_DAYS'] if grace_days is None else grace_days
+    )
+    print(f"✅ {result['overdue']} cuotas marcadas como vencidas, {result['late_fees']} cuotas de mora")
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Aplica las migraciones pendientes del esquema"""
+    applied = run_migrations()
+    reconcile_classroom_counters()
+    print(f"✅ Esquema al día ({len(applied)} migraciones aplicadas)")
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """Ejecuta cada GET /api/* e imprime el plan de sus consultas"""
+    captured = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+    
+    client = admin_test_client()
+    for endpoint, url, query_string in api_get_requests():
+        captured.clear()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            client.get(url, query_string=query_string)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        
+        print(f"\n=== {endpoint} ({url}) — {len(captured)} consultas ===")
+        seen = set()
+        with db.engine.connect() as connection:
+            for statement, parameters in captured:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                print('  ' + ' '.join(statement.split())[:200])
+                for line in explain_statement(connection, statement, parameters):
+                    print(f"    → {line}")
+
+@app.cli.command('seed-data')
+@click.option('--classrooms', default=50, show_default=True, help='Aulas a crear')
+@click.option('--students', default=20000, show_default=True, help='Estudiantes a crear')
+@click.option('--installments', default=10, show_default=True, help='Cuotas por plan de pensiones')
+@click.option('--utiles', default=15, show_default=True, help='Útiles requeridos por aula')
+@click.option('--materials', default=300, show_default=True, help='Materiales de almacén')
+@click.option('--bienes', default=600, show_default=True, help='Bienes patrimoniales')
+@click.option('--seed', default=42, show_default=True, help='Semilla del generador aleatorio')
+@click.option('--append', is_flag=True, help='Agregar aunque la base ya tenga estudiantes')
+def seed_data_command(classrooms, students, installments, utiles, materials, bienes, seed, append):
+    """Llena la base configurada con datos sintéticos para pruebas de carga"""
+    run_migrations()
+    if not append and db.session.query(Student.id).first():
+        print("⚠️ La base ya tiene estudiantes; use --append o una DATABASE_URL vacía")
+        raise SystemExit(1)
+    
+    started = time.perf_counter()
+    counts = seed_dataset(classrooms, students, installments, utiles, materials, bienes, random.Random(seed))
+    for table, count in counts.items():
+        print(f"  {table}: {count}")
+    print(f"✅ Datos sintéticos generados en {time.perf_counter() - started:.1f} s")
+
+@app.cli.command('benchmark')
+@click.option('--iterations', default=20, show_default=True, help='Ejecuciones medidas por endpoint')
+@click.option('--baseline', 'baseline_path', default='benchmark_baseline.json', show_default=True)
+@click.option('--save-baseline', is_flag=True, help='Guardar los resultados como nueva línea base')
+@click.option('--tolerance', default=0.25, show_default=True, help='Aumento de p95 permitido (0.25 = 25%)')
+def benchmark_command(iterations, baseline_path, save_baseline, tolerance):
+    """Mide cada GET /api/* y lo compara con la línea base guardada"""
+    results = run_benchmark(iterations)
+    
+    baseline = {}
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)['endpoints']
+    regressions = compare_benchmark(results, baseline, tolerance)
+    
+    print(f"{'endpoint':<40} {'estado':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'consultas':>9}")
+    for endpoint, r in results.items():
+        mark = '  ❌ ' + '; '.join(regressions[endpoint]) if endpoint in regressions else ''
+        print(f"{endpoint:<40} {r['status']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['queries']:>9}{mark}")
+    
+    if save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'database': db.engine.dialect.name,
+                'iterations': iterations,
+                'endpoints': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"✅ Línea base guardada en {baseline_path}")
+    elif regressions:
+        print(f"❌ {len(regressions)} endpoints con regresiones")
+        raise SystemExit(1)
+    elif not baseline:
+        print(f"ℹ️ Sin línea base en {baseline_path}; ejecute con --save-baseline para crearla")
+    else:
+        print("✅ Sin regresiones respecto de la línea base")
+
 # === INICIO PARA PRODUCCIÓN ===
 if __name__ == '__main__':
     init_database()
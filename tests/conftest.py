@@ -0,0 +1,33 @@
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+# app.py configura la base al importarse: por defecto una SQLite temporal; con
+# TEST_DATABASE_URL (por ejemplo una base Postgres vacía) se prueba ese motor.
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['OVERDUE_SWEEP_INTERVAL'] = '0'
+os.environ['JOB_RESULTS_DIR'] = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as school_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Base migrada con un conjunto chico de datos sintéticos"""
+    school_app.init_database()
+    with school_app.app.app_context():
+        school_app.seed_dataset(
+            classrooms=4, students=80, installments=6, utiles=3, materials=10, bienes=10, rng=random.Random(42)
+        )
+    # Con testing, exceder un presupuesto de consultas lanza QueryBudgetExceeded
+    school_app.app.testing = True
+    return school_app.app
+
+
+@pytest.fixture
+def client(app):
+    return school_app.admin_test_client()
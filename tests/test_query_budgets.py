@@ -0,0 +1,32 @@
+import pytest
+
+import app as school_app
+
+BUDGETED_REQUESTS = [
+    (endpoint, url, query_string)
+    for endpoint, url, query_string in school_app.api_get_requests()
+    if hasattr(school_app.app.view_functions[endpoint], 'query_budget')
+]
+
+
+@pytest.mark.parametrize(
+    'endpoint, url, query_string', BUDGETED_REQUESTS, ids=[endpoint for endpoint, _, _ in BUDGETED_REQUESTS]
+)
+def test_get_route_stays_within_query_budget(client, endpoint, url, query_string):
+    # Caché vacía: se mide la consulta real, no una respuesta ya guardada
+    school_app.response_cache.clear()
+    response = client.get(url, query_string=query_string)  # QueryBudgetExceeded si se pasa
+    response.get_data()
+    response.close()
+    assert response.status_code < 500, response.get_data(as_text=True)
+
+
+def test_budget_violation_raises(app, client):
+    @school_app.query_budget(0)
+    def over_budget():
+        return school_app.jsonify(school_app.SchoolYear.query.count())
+
+    with app.test_request_context('/api/test'):
+        app.preprocess_request()
+        with pytest.raises(school_app.QueryBudgetExceeded):
+            over_budget()
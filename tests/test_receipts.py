@@ -0,0 +1,66 @@
+import threading
+from datetime import date
+
+import app as school_app
+
+THREADS = 16
+STANDALONE_PAYMENTS = 2000
+INSTALLMENT_PAYMENTS = 50
+
+
+def receipt_suffix(receipt_number):
+    prefix = f"R-{date.today().strftime('%Y%m%d')}-"
+    assert receipt_number.startswith(prefix), receipt_number
+    return int(receipt_number[len(prefix):])
+
+
+def test_parallel_payments_get_consecutive_unique_receipts(app):
+    with app.app_context():
+        student_id, concept_id = school_app.db.session.execute(
+            school_app.db.select(school_app.PaymentPlan.student_id, school_app.PaymentPlan.concept_id).limit(1)
+        ).one()
+        installment_ids = school_app.db.session.execute(
+            school_app.db.select(school_app.PaymentInstallment.id)
+            .where(school_app.PaymentInstallment.status != 'paid')
+            .limit(INSTALLMENT_PAYMENTS)
+        ).scalars().all()
+    assert len(installment_ids) == INSTALLMENT_PAYMENTS
+
+    # Pagos sueltos y pagos de cuotas mezclados: los dos caminos toman número del mismo contador
+    today = date.today().isoformat()
+    tasks = [('/api/payments', {
+        'student_id': student_id, 'concept_id': concept_id, 'amount': 10,
+        'payment_date': today, 'due_date': today
+    })] * STANDALONE_PAYMENTS
+    tasks += [(f'/api/installments/{installment_id}/pay', {'payment_date': today}) for installment_id in installment_ids]
+
+    results = []
+    lock = threading.Lock()
+
+    def worker(batch):
+        client = school_app.admin_test_client()
+        for url, body in batch:
+            response = client.post(url, json=body)
+            with lock:
+                results.append((response.status_code, response.get_json()))
+
+    threads = [threading.Thread(target=worker, args=(tasks[i::THREADS],)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == len(tasks)
+    errors = [(status, body) for status, body in results if status != 200 or not body.get('success')]
+    assert not errors, errors[:5]
+
+    # Sin duplicados ni huecos entre los recibos emitidos
+    suffixes = sorted(receipt_suffix(body['receipt_number']) for _, body in results)
+    assert len(set(suffixes)) == len(suffixes)
+    assert suffixes == list(range(suffixes[0], suffixes[0] + len(suffixes)))
+
+    with app.app_context():
+        stored = school_app.db.session.query(school_app.Payment).filter(
+            school_app.Payment.receipt_number.in_([body['receipt_number'] for _, body in results])
+        ).count()
+    assert stored == len(tasks)